@@ -3,31 +3,22 @@
 import parser
 import analytics_config as config
 import matplotlib.pyplot as plt
+import numpy as np
 
-def exponential_smoothing(data, alpha):
-    filtered_data = [0]*len(data)
-    filtered_data[0] = data[0]
-    for i, x in enumerate(data[1:]):
-        filtered_data[i+1] = alpha * x + (1 - alpha) * filtered_data[i]
-    return filtered_data
+accel_data = parser.flight_data('z-acceleration', -1, 'acceleration', config.ACCEL_DATA,
+    timecol=config.ACCEL_TIME_COLUMN, datacol=config.ACCEL_COLUMN)
 
-accel_data = parser.flight_data('z-acceleration', -1, 'acceleration', config.ACCEL_DATA, datacol=12)
-
-parsed_time = [accel_data.time[0]]
-parsed_readings = [accel_data.readings[0]]
-for t, a in zip(accel_data.time[1:], accel_data.readings[1:]):
-    if (t != parsed_time[-1]):
-        parsed_time.append(t)
-        parsed_readings.append(a)
-accel_data.time = parsed_time
-accel_data.readings = parsed_readings
+accel_data.remove_duplicate_times()
     
-accel_data.readings = [a/-9.81 for a in accel_data.readings]
+accel_data.readings = accel_data.readings / -9.81
+
+# Filter every alpha in one call, one channel per alpha
+alphas = [a * 0.1 for a in range(1, 10)]
+filtered = parser.exponential_filter(alphas)(np.tile(accel_data.readings, (len(alphas), 1)))
 
 plt.plot(accel_data.time, accel_data.readings, 'k-', linewidth=3)
-for a in range(1, 10):
+for a, filt in zip(range(1, 10), filtered):
     print(a* 0.1)
-    filt = exponential_smoothing(accel_data.readings, a * 0.1)
     plt.plot(accel_data.time, filt, zorder=10-a, label=f"alpha={a * 0.1}", linewidth=1)
 plt.legend(loc='best')
 plt.ylabel("Z-Acceleration (g-units)")
@@ -35,10 +26,12 @@ plt.xlabel("Time")
 plt.title("Acceleration Data with Varied Exponential Filter")
 plt.show()
 
+alphas = [a / 100 for a in range(10, 35, 5)]
+filtered = parser.exponential_filter(alphas)(np.tile(accel_data.readings, (len(alphas), 1)))
+
 plt.plot(accel_data.time, accel_data.readings, 'k-', linewidth=3)
-for i, a in enumerate(range(10, 35, 5)):
+for i, (a, filt) in enumerate(zip(range(10, 35, 5), filtered)):
     print(a / 100)
-    filt = exponential_smoothing(accel_data.readings, a / 100)
     plt.plot(accel_data.time, filt, zorder=10-i, label=f"alpha={a / 100}", linewidth=1)
 plt.legend(loc='best')
 plt.ylabel("Z-Acceleration (g-units)")
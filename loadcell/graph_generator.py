@@ -5,16 +5,16 @@ import pandas as pd
 from typing import List
 from ingest import *
 
-flight_data = pd.read_csv('../data/FlightData.csv')
+flight_data = lazy_csv('../data/FlightData.csv')
 flight_data["GPS Time (s)"] -= flight_data["GPS Time (s)"][0]
 
-loadcell_0 = pd.read_csv('../data/%s/load_cell_0_readings.csv' % (LOADCELL_DATA_FOLDER))
-loadcell_1 = pd.read_csv('../data/%s/load_cell_1_readings.csv' % (LOADCELL_DATA_FOLDER))
-loadcell_2 = pd.read_csv('../data/%s/load_cell_2_readings.csv' % (LOADCELL_DATA_FOLDER))
-loadcell_3 = pd.read_csv('../data/%s/load_cell_3_readings.csv' % (LOADCELL_DATA_FOLDER))
-loadcell_4 = pd.read_csv('../data/%s/load_cell_4_readings.csv' % (LOADCELL_DATA_FOLDER))
-loadcell_5 = pd.read_csv('../data/%s/load_cell_5_readings.csv' % (LOADCELL_DATA_FOLDER))
-state      = pd.read_csv('../data/%s/state.csv' % (LOADCELL_DATA_FOLDER))
+loadcell_0 = data_cache.read_csv('../data/%s/load_cell_0_readings.csv' % (LOADCELL_DATA_FOLDER))
+loadcell_1 = data_cache.read_csv('../data/%s/load_cell_1_readings.csv' % (LOADCELL_DATA_FOLDER))
+loadcell_2 = data_cache.read_csv('../data/%s/load_cell_2_readings.csv' % (LOADCELL_DATA_FOLDER))
+loadcell_3 = data_cache.read_csv('../data/%s/load_cell_3_readings.csv' % (LOADCELL_DATA_FOLDER))
+loadcell_4 = data_cache.read_csv('../data/%s/load_cell_4_readings.csv' % (LOADCELL_DATA_FOLDER))
+loadcell_5 = data_cache.read_csv('../data/%s/load_cell_5_readings.csv' % (LOADCELL_DATA_FOLDER))
+state      = data_cache.read_csv('../data/%s/state.csv' % (LOADCELL_DATA_FOLDER))
 
 min_time = min([
     loadcell_0["Time"][0],
@@ -44,6 +44,7 @@ plt.hlines([-MICRO_G_ENTRY_THRESHOLD, -MICRO_G_EXIT_THRESHOLD, -9.8], min(flight
 plt.vlines([p.start for p in parabolas], min(flight_accel), max(flight_accel), color="r")
 plt.vlines([p.end for p in parabolas], min(flight_accel), max(flight_accel), color="g")
 
-plt.plot(loadcell_0["Time"] + 390, loadcell_0["Reading"]/1e6)
+# The offset is relative to the first load cell time
+plt.plot(loadcell_0["Time"] - loadcell_0["Time"][0] + ReadOffset(), loadcell_0["Reading"]/1e6)
 
 plt.show()
\ No newline at end of file
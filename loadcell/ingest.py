@@ -1,12 +1,19 @@
 import pandas as pd
 import json
 from typing import List
-import scipy.optimize as optimize
+import sys
+from os.path import abspath, dirname, join
+
+sys.path.append(abspath(join(dirname(__file__), '../src')))
+import data_cache
+from lazy_csv import lazy_csv
+from analytics_config import MICRO_G_ENTRY_THRESHOLD, MICRO_G_EXIT_THRESHOLD, MIN_PARABOLA_TIME
+from parabola_parser import detect_parabolas
+from parser import remove_duplicate_times, accel_offset
+from offset_estimation import estimate_offsets, print_estimates, save_offset
+from state_index import state_interval_index
 
 LOADCELL_DATA_FOLDER = "7_24_15_10_30"
-MICRO_G_ENTRY_THRESHOLD = 0.2
-MICRO_G_EXIT_THRESHOLD = 0.5
-MIN_PARABOLA_TIME = 10
 
 class StateTimeRange:
     def __init__(self, state: str, start: float, end: float):
@@ -58,22 +65,24 @@ def ReadParabolas() -> List[ParabolaTimeRange]:
         json_list = json.loads(f.read())
         return [JsonToParabolaTimeRange(json.dumps(d)) for d in json_list]
 
-def FitError(params) -> float:
-    A = params[0]
-    B = params[0]
-    T0 = params[0]
-    return abs(A**2 + B**2)
+def WriteOffsets(offset: float, significance: float, estimates) -> float:
+    # Saved like parser.get_data() does, so the src/ scripts can read the offset
+    return save_offset(offset, significance, estimates, "../out/offsets.json",
+                       "../data/%s/" % (LOADCELL_DATA_FOLDER), "../data/FlightData.csv")
+
+def ReadOffset() -> float:
+    return accel_offset("../data/%s/" % (LOADCELL_DATA_FOLDER), "../data/FlightData.csv")
 
 if __name__ == "__main__":
     # Load & zero all of our data
     print("Loading and zeroing from %s" % (LOADCELL_DATA_FOLDER))
-    loadcell_0 = pd.read_csv('../data/%s/load_cell_0_readings.csv' % (LOADCELL_DATA_FOLDER))
-    loadcell_1 = pd.read_csv('../data/%s/load_cell_1_readings.csv' % (LOADCELL_DATA_FOLDER))
-    loadcell_2 = pd.read_csv('../data/%s/load_cell_2_readings.csv' % (LOADCELL_DATA_FOLDER))
-    loadcell_3 = pd.read_csv('../data/%s/load_cell_3_readings.csv' % (LOADCELL_DATA_FOLDER))
-    loadcell_4 = pd.read_csv('../data/%s/load_cell_4_readings.csv' % (LOADCELL_DATA_FOLDER))
-    loadcell_5 = pd.read_csv('../data/%s/load_cell_5_readings.csv' % (LOADCELL_DATA_FOLDER))
-    state      = pd.read_csv('../data/%s/state.csv' % (LOADCELL_DATA_FOLDER))
+    loadcell_0 = data_cache.read_csv('../data/%s/load_cell_0_readings.csv' % (LOADCELL_DATA_FOLDER))
+    loadcell_1 = data_cache.read_csv('../data/%s/load_cell_1_readings.csv' % (LOADCELL_DATA_FOLDER))
+    loadcell_2 = data_cache.read_csv('../data/%s/load_cell_2_readings.csv' % (LOADCELL_DATA_FOLDER))
+    loadcell_3 = data_cache.read_csv('../data/%s/load_cell_3_readings.csv' % (LOADCELL_DATA_FOLDER))
+    loadcell_4 = data_cache.read_csv('../data/%s/load_cell_4_readings.csv' % (LOADCELL_DATA_FOLDER))
+    loadcell_5 = data_cache.read_csv('../data/%s/load_cell_5_readings.csv' % (LOADCELL_DATA_FOLDER))
+    state      = data_cache.read_csv('../data/%s/state.csv' % (LOADCELL_DATA_FOLDER))
 
     min_time = min([
         loadcell_0["Time"][0],
@@ -95,44 +104,25 @@ if __name__ == "__main__":
 
     # Load & zero flight data
     print("Loading and zeroing from flight data")
-    flight_data = pd.read_csv('../data/FlightData.csv')
+    flight_data = lazy_csv('../data/FlightData.csv')
     flight_data["GPS Time (s)"] -= flight_data["GPS Time (s)"][0]
 
     #Find state transitions from "state" dataframe
     print("Finding state transitions")
-    state_transitions = []
-    curr_state = StateTimeRange(state["State"][0], state["Time"][0], state["Time"][0])
-    for i in range(len(state.index)): 
-        curr_row = state.iloc[i]
-        curr_state.end = curr_row["Time"]
-
-        if curr_row["State"] != curr_state.state:
-            state_transitions.append(curr_state)
-            curr_state = StateTimeRange(curr_row["State"], curr_row["Time"], curr_row["Time"])
-    state_transitions.append(curr_state)
+    index = state_interval_index(state["Time"].to_numpy(), state["State"].to_numpy())
+    state_transitions = [StateTimeRange(str(s), float(start), float(end)) for s, start, end in index.intervals]
     
     WriteStateTransitions(state_transitions)
 
     #Find parabola start & end times from "flight_data" dataframe
     print("Finding parabolas")
-    parabolas = []
-    curr_parabola = None
-    for i in range(len(flight_data.index)):
-        accel = -flight_data["Az (m/s^2)"][i]
-        time = flight_data["GPS Time (s)"][i]
-
-        if (MICRO_G_ENTRY_THRESHOLD > accel) and (curr_parabola == None):
-            curr_parabola = ParabolaTimeRange(time, 0)
-
-        if (accel > MICRO_G_EXIT_THRESHOLD) and (curr_parabola != None) and (time - curr_parabola.start >= MIN_PARABOLA_TIME):
-            curr_parabola.end = time
-            parabolas.append(curr_parabola)
-            curr_parabola = None
+    parabolas = [ParabolaTimeRange(float(p['start']), float(p['end']))
+                 for p in detect_parabolas(flight_data["GPS Time (s)"], flight_data["Az (m/s^2)"])]
 
     WriteParabolas(parabolas)
 
-    #Fit each of the load cell readings to the flight acceleration
-    print("Fitting load cell readings to flight acceleration")
+    #Cross-correlate each of the load cell readings with the flight acceleration to find the offset
+    print("Estimating the offset of the flight acceleration")
     loadcells = [
         loadcell_0,
         loadcell_1,
@@ -141,8 +131,11 @@ if __name__ == "__main__":
         loadcell_4,
         loadcell_5
     ]
-    for i in range(len(loadcells)):
-        # Params are A, B & T0
-        initial_params = [1, 1, 390]
-        result = optimize.minimize(lambda params: FitError(params), initial_params)
-        print(result.success, result.x, result.message)
+    accel_time, accel, _ = remove_duplicate_times(flight_data["GPS Time (s)"], flight_data["Az (m/s^2)"])
+    # Offsets are relative to the first load cell time, the time zero of the src/ scripts
+    t0 = loadcell_0["Time"][0]
+    offset, significance, estimates = estimate_offsets([l["Time"].to_numpy() - t0 for l in loadcells],
+                                                       [l["Reading"].to_numpy() for l in loadcells], accel_time, accel)
+    print_estimates(offset, significance, estimates)
+
+    WriteOffsets(offset, significance, estimates)
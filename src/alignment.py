@@ -0,0 +1,190 @@
+# Filename: alignment.py  SRC: J.Coppens 2020
+
+import numpy as np
+import pandas as pd
+import analytics_config as config
+import parser
+from csv_writer import write_csv
+from lazy_csv import lazy_csv
+from timeseries import Timeseries
+
+METHODS = ('linear', 'nearest', 'previous', 'next')
+
+class stream:
+    '''
+    One input of align(): a series of samples and how to look it up at other times.
+
+    Args:
+        name: Column name in the aligned data.
+        time: Sorted sample times (seconds on the flight clock, or see 'offset').
+        values: Samples, either one value per sample or a (sample, column) array.
+        method: 'linear' interpolates between the samples around each time, 'nearest' takes the
+            closest sample, 'previous'/'next' take the last sample at or before / first sample at
+            or after each time (as-of joins, e.g. 'previous' for states).
+        tolerance: Largest distance (in seconds) between a time and the sample it is looked up
+            from, or for 'linear' between the two samples it is interpolated between. Times
+            further from the data (gaps, dropped samples, outside the stream) get 'fill'.
+        fill: Value for times without data. NaN by default, which makes integer streams float.
+        offset: Added to 'time', e.g. to move video times onto the flight clock.
+    '''
+    def __init__(self, name, time, values, method='linear', tolerance=np.inf, fill=np.nan, offset=0.0):
+        if method not in METHODS:
+            raise ValueError(f"Unknown alignment method '{method}', expected one of {METHODS}")
+        self.name = name
+        time = np.asarray(time, dtype=np.float64)
+        self.series = Timeseries(time + offset if offset else time, values)
+        self.values = self.series.vals
+        self.method = method
+        self.tolerance = tolerance
+        self.fill = fill
+
+    @classmethod
+    def from_channel(cls, channel, column='readings', name=None, **kwargs):
+        '''
+        Stream of one column of a flight_data or processed_flight_data channel.
+        '''
+        return cls(name or channel.name, channel.time, getattr(channel, column), **kwargs)
+
+    @property
+    def time(self):
+        return self.series.ts
+
+    def dtype(self):
+        dtype = np.result_type(self.values.dtype, np.asarray(self.fill).dtype)
+        return np.result_type(dtype, np.float64) if self.method == 'linear' else dtype
+
+    def lookup(self, t, out):
+        '''
+        Write the stream's values at times 't' into 'out'.
+        '''
+        ts, n = self.time, len(self.time)
+        if self.method == 'linear':
+            # Last sample at or before and first sample at or after each time, the gap between
+            # them is what gets interpolated across (zero on an exact sample)
+            left = np.searchsorted(ts, t, side='right') - 1
+            right = np.searchsorted(ts, t, side='left')
+            found = (left >= 0) & (right < n)
+            gap = ts[np.clip(right, 0, n - 1)] - ts[np.clip(left, 0, n - 1)]
+            missing = ~found | (gap > self.tolerance)
+            values = self.values.reshape(n, -1)
+            result = out.reshape(len(t), -1)
+            for j in range(values.shape[1]):
+                result[:, j] = np.interp(t, ts, values[:, j])
+        else:
+            if self.method == 'nearest':
+                idx = self.series.index(t)
+            elif self.method == 'previous':
+                idx = np.searchsorted(ts, t, side='right') - 1
+            else:
+                idx = np.searchsorted(ts, t, side='left')
+            found = (idx >= 0) & (idx < n)
+            idx = np.clip(idx, 0, n - 1)
+            missing = ~found | (np.abs(t - ts[idx]) > self.tolerance)
+            out[...] = self.values[idx]
+        out[missing] = self.fill
+
+def common_grid(streams, step, span='overlap'):
+    '''
+    Evenly spaced grid (every 'step' seconds) over the time all streams cover ('overlap') or the
+    time any stream covers ('union').
+    '''
+    starts = [s.time[0] for s in streams if len(s.time)]
+    ends = [s.time[-1] for s in streams if len(s.time)]
+    t0, t1 = (max(starts), min(ends)) if span == 'overlap' else (min(starts), max(ends))
+    return t0 + step * np.arange(int(np.floor((t1 - t0) / step)) + 1)
+
+def align(streams, grid, chunk=1<<18):
+    '''
+    Merge streams onto one set of times.
+
+    Every stream is looked up at every grid time with a vectorized join (see stream), so streams
+    with different or drifting clocks and dropped samples line up by time rather than by row. The
+    grid is processed 'chunk' times at a time into preallocated outputs, so full rate streams only
+    need temporary memory for one chunk.
+
+    Args:
+        streams: List of stream objects.
+        grid: Times to align onto, e.g. common_grid(streams, step) or one stream's times.
+
+    Returns:
+        Dict with the grid under 'time' and the aligned values of each stream under its name.
+    '''
+    grid = np.asarray(grid, dtype=np.float64)
+    aligned = {'time': grid}
+    for s in streams:
+        out = np.empty((len(grid),) + s.values.shape[1:], dtype=s.dtype())
+        for start in range(0, len(grid), chunk):
+            s.lookup(grid[start:start + chunk], out[start:start + chunk])
+        aligned[s.name] = out
+    return aligned
+
+def write_aligned(path, aligned, formats=None):
+    '''
+    Write aligned data to a csv file, one row per grid time. Multi column streams are written as
+    '<name> 1', '<name> 2', ...
+    '''
+    names, columns = [], []
+    for name, values in aligned.items():
+        if values.ndim == 1:
+            names.append(name)
+            columns.append(values)
+        else:
+            names += [f"{name} {j+1}" for j in range(values.shape[1])]
+            columns += list(values.T)
+    formats = formats or ['%.4f'] + ['%f'] * (len(columns) - 1)
+    return write_csv(path, [','.join(names)], columns, formats)
+
+def pump_streams(path, t0, **kwargs):
+    '''
+    Pump voltage streams ('Pump 1 Voltage', 'Pump 2 Voltage') from a state.csv file, zeroed to 't0'
+    like the other streams.
+    '''
+    data = lazy_csv(path)
+    time = data[0] - t0
+    return [stream(name, time, data[name], **kwargs) for name in ('Pump 1 Voltage', 'Pump 2 Voltage')]
+
+def flow_streams(path, t0, **kwargs):
+    '''
+    Flow meter streams ('Flow 1' to 'Flow 3') from a flow_readings.csv file, zeroed to 't0'.
+    '''
+    data = lazy_csv(path)
+    time = data[0] - t0
+    return [stream(name, time, data[name], **kwargs) for name in ('Flow 1', 'Flow 2', 'Flow 3')]
+
+def state_stream(path, t0, **kwargs):
+    '''
+    State codes (parser.STATE_CODES) at the full rate of a state.csv file, zeroed to 't0'. Unlike
+    the processed states channel this is not downsampled, so short states are kept.
+    '''
+    data = lazy_csv(path)
+    return stream('State', data[0] - t0, parser.state_codes(data['State']), method='previous',
+                  fill=parser.UNKNOWN_STATE, **kwargs)
+
+def video_stream(path, offset, name='Video', **kwargs):
+    '''
+    Stream of the fluid heights of a video csv file (see video/csv_generator.py), one column per
+    tank slice. 'offset' moves the video times onto the flight clock.
+    '''
+    df = pd.read_csv(path)
+    return stream(name, df['Time'].to_numpy(), df[df.columns[2:]].to_numpy(), offset=offset, **kwargs)
+
+def flight_streams(raw_data, accel_data, t0, datapath=config.DATAPATH):
+    '''
+    The standard streams of a flight: the full rate load cells, acceleration and flow meters
+    interpolated, and the state and pump voltages of state.csv as of each time.
+    '''
+    streams = [stream.from_channel(cell, tolerance=config.ALIGN_TOLERANCE) for cell in raw_data]
+    streams.append(stream.from_channel(accel_data, name='Accel', tolerance=config.ALIGN_TOLERANCE))
+    streams += flow_streams(datapath + 'flow_readings.csv', t0, tolerance=config.ALIGN_TOLERANCE)
+    streams.append(state_stream(datapath + 'state.csv', t0, tolerance=config.ALIGN_TOLERANCE))
+    streams += pump_streams(datapath + 'state.csv', t0, method='previous', tolerance=config.ALIGN_TOLERANCE)
+    return streams
+
+if __name__ == "__main__":
+    raw_data, accel_data, _, _ = parser.get_data(workers=config.WORKERS)
+    t0 = lazy_csv(config.DATAPATH + parser.LOADCELLS[0][2])[0][0]
+
+    streams = flight_streams(raw_data, accel_data, t0)
+    aligned = align(streams, common_grid(streams, config.ALIGN_STEP))
+    print(f"Writing {len(aligned['time'])} aligned rows to {config.ALIGNED_DATA}")
+    write_aligned(config.ALIGNED_DATA, aligned)
@@ -2,20 +2,75 @@
 
 # File paths
 
-DATAPATH = '../data/7_24_15_10_30/'
+DATAROOT = '../data/'
+DATAPATH = DATAROOT + '7_24_15_10_30/'
 ACCEL_DATA = '../data/FlightData.csv'
 OUTPATH = '../out/'
 IMGPATH = OUTPATH + 'IMG/'
 PARABOLAS = OUTPATH + 'parabolas.csv' 
 PROCESSED_DATA = OUTPATH + 'processed_data.csv'
 RAW_DATA = OUTPATH + 'raw_data.csv'
+PARABOLA_ANALYTICS = OUTPATH + 'parabola_analytics.csv'
+ALIGNED_DATA = OUTPATH + 'aligned_data.csv'
+PROCESSED_STORE = OUTPATH + 'processed_data/'
+RAW_STORE = OUTPATH + 'raw_data/'
+CACHEPATH = OUTPATH + 'cache/'    # set to None to always parse the csv files
+OFFSET_FILE = OUTPATH + 'offsets.json'
+
+# size limit (in bytes) of the parsed csv cache, least recently used files are evicted past this
+CACHE_SIZE_LIMIT = 1024**3
+
+# columns of the NRC flight data used for acceleration
+ACCEL_TIME_COLUMN = 'GPS Time (s)'
+ACCEL_COLUMN = 'Az (m/s^2)'
 
 # thresholds (in m/s^2) for determining when micro-g portion of flight begins/ends
 MICRO_G_ENTRY_THRESHOLD = 0.2
 MICRO_G_EXIT_THRESHOLD = 0.5
 
-# offset (in seconds) between our tank sensor data and accel data provided by the NRC
+# minimum length (in seconds) of a micro-g window before an exit crossing ends the parabola
+MIN_PARABOLA_TIME = 10
+
+# grid spacing (in seconds) of the aligned data and the largest distance (in seconds) between a grid
+# time and the sample it is looked up from, or between the two samples interpolated across (alignment.py)
+ALIGN_STEP = 0.6
+ALIGN_TOLERANCE = 1.0
+
+# number of threads used to load and process the sensor data in parser.get_data()
+WORKERS = 8
+
+# offset (in seconds) between our tank sensor data and accel data provided by the NRC, calibrated by hand
+# for the 7_24_15_10_30 flight. None uses the estimate from the data instead (offset_estimation.py).
+# parser.get_data() estimates it either way and saves the estimate next to the offset used in
+# OFFSET_FILE, which the other scripts and incremental.py read. The fallback is used when OFFSET is None
+# and the estimate is not significant, or by incremental.py when no offset has been saved yet.
 OFFSET = 390
+OFFSET_FALLBACK = 390
+
+# largest difference (in seconds) between OFFSET and a significant estimate before get_data() warns
+OFFSET_TOLERANCE = 1.0
+
+# offset estimation: grid spacing (in seconds) of the cross-correlated signals, window (in seconds) of
+# the running mean removed from them as drift, fraction of the shorter record that has to overlap at a
+# lag, and the significance (robust z-score of the correlation peak) below which the estimate is not
+# used. On synthetic flights, load cells unrelated to the accel give significances of 3.5 to 5.5 (up to
+# 7.5 for single load cells) and load cells following it with a known offset 15 to 30 (unless noise
+# buries the parabolas), so 8 separates the two. Not yet checked against a real flight with a known
+# offset.
+OFFSET_STEP = 0.1
+OFFSET_DRIFT_WINDOW = 120
+OFFSET_MIN_OVERLAP = 0.5
+OFFSET_MIN_SIGNIFICANCE = 8
+
+# samples kept for each parabola by parabola_parser: (samples before the parabola start, total samples)
+PARABOLA_WINDOW = (3, 30)
+
+# readings are settled (parabola_analytics) once they stay within this fraction of the parabola's
+# reading range around the final reading
+SETTLE_BAND = 0.05
+
+# spacing (in seconds) of the relative time grid parabolas are resampled onto (parabola_tensor)
+PARABOLA_GRID_STEP = 0.1
 
 # time intervals for different parabolas sets
 ALL_PARABOLAS = (1200, 2700)
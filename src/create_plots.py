@@ -3,10 +3,15 @@
 import parser
 import analytics_config as config
 import flight_data_plotting as fdplot
+import parabola_analytics
 from plotting_utils import read_in_data
 
 processed_data, state_data, accel_data, parabola_times, detailed_parab_data,  = read_in_data()
 
+### Parabola analytics (effective mass, ratios and summary table), shared by the ratio plots
+parab_analytics = parabola_analytics.parabola_analytics(detailed_parab_data)
+parab_analytics.write()
+
 ### Acceleration Data
 # fdplot.plot_z_acceleration(
 #         accel = accel_data, 
@@ -85,7 +90,8 @@ fdplot.detailed_parabola_ratio_plots(
         accel = accel_data,
         states = state_data,
         output_type = "Effective Mass",
-        zero_to_parab_start = True)
+        zero_to_parab_start = True,
+        analytics = parab_analytics)
 
 # fdplot.detailed_parabola_ratio_plots(
 #         parabs = detailed_parab_data, 
@@ -0,0 +1,84 @@
+# Filename: csv_writer.py  SRC: J.Coppens 2020
+
+import numpy as np
+import re
+
+def column_format(fmt, column):
+    '''
+    Printf format actually used for 'column'. Fixed point formats of integer columns are swapped
+    for an integer format with the decimals spelled out, e.g. '%f' -> '%d.000000', which gives the
+    same text without converting every reading to a float first.
+    '''
+    match = re.fullmatch(r'%\.?(\d*)f', fmt)
+    if match and np.issubdtype(np.asarray(column).dtype, np.integer):
+        decimals = int(match.group(1) or 6)
+        return '%d' + ('.' + '0' * decimals if decimals > 0 else '')
+    return fmt
+
+class csv_writer:
+    '''
+    Csv writer that formats a whole block of rows per call instead of one row at a time.
+
+    Each block is formatted with a single printf style format call (one format per column, e.g.
+    '%.4f' for times and '%f' for readings) and handed to a large write buffer, so long exports
+    are limited by the disk rather than by per-row Python overhead. Blocks can be written as they
+    become available (streaming), with flush() after each one to get them to disk.
+
+    Args:
+        path: File to write.
+        header: List of header lines (without line endings).
+        formats: List of printf style formats, one per column.
+        newline: Line ending written after every line. Written as is on every platform.
+        chunk_rows: Number of rows formatted per format call.
+    '''
+    def __init__(self, path, header, formats, delimiter=',', newline='\r\n', chunk_rows=50000,
+            buffer_size=1<<22):
+        self.formats = formats
+        self.delimiter = delimiter
+        self.newline = newline
+        self.chunk_rows = chunk_rows
+        self.rows = 0
+        self.file = open(path, 'w', newline='', buffering=buffer_size)
+        for line in header:
+            self.file.write(line + newline)
+
+    def write(self, columns):
+        '''
+        Append rows given as a list of columns (one array per format). If the columns are not
+        all the same length only the rows every column has are written.
+        '''
+        n = min(len(c) for c in columns)
+        k = len(columns)
+        row = self.delimiter.join(column_format(f, c) for f, c in zip(self.formats, columns)) + self.newline
+        for start in range(0, n, self.chunk_rows):
+            stop = min(start + self.chunk_rows, n)
+            # Interleave the columns into one flat row-major list, keeping ints as ints
+            values = [None] * ((stop - start) * k)
+            for j, column in enumerate(columns):
+                values[j::k] = np.asarray(column[start:stop]).tolist()
+            self.file.write((row * (stop - start)) % tuple(values))
+        self.rows += n
+        return n
+
+    def flush(self):
+        '''
+        Hand everything written so far to the OS, e.g. after each block of a long running export so
+        a crash loses at most the block being formatted.
+        '''
+        self.file.flush()
+
+    def close(self):
+        self.file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+def write_csv(path, header, columns, formats, **kwargs):
+    '''
+    Write 'columns' to a csv file at 'path' in one go. See csv_writer for the arguments.
+    '''
+    with csv_writer(path, header, formats, **kwargs) as writer:
+        return writer.write(columns)
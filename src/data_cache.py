@@ -0,0 +1,118 @@
+# Filename: data_cache.py  SRC: J.Coppens 2020
+
+import analytics_config as config
+import numpy as np
+import pandas as pd
+import hashlib
+import json
+import os
+import shutil
+import threading
+
+CACHE_VERSION = 1
+
+def cache_key(path, columns):
+    '''
+    Key for the parsed 'columns' of the file at 'path'. Changes whenever the file is rewritten or
+    appended to, since its size and modification time are part of the key.
+    '''
+    stat = os.stat(path)
+    key = json.dumps([CACHE_VERSION, os.path.abspath(path), stat.st_size, stat.st_mtime_ns,
+                      [str(c) for c in columns]])
+    return hashlib.sha1(key.encode()).hexdigest()
+
+def load(path, columns, parse):
+    '''
+    Load parsed columns of a csv file from the cache, parsing and caching them on a miss.
+
+    Each column is stored as its own .npy file and loaded memory mapped (copy-on-write), so a warm
+    start does no text parsing and only pages in what is actually used.
+
+    Args:
+        path: Path of the csv file.
+        columns: The columns selected from the file, only used to build the cache key.
+        parse: Function taking no arguments that parses the file and returns a dict of column
+            name -> array. Called only on a cache miss.
+
+    Returns:
+        Dict of column name -> array.
+    '''
+    if config.CACHEPATH is None:
+        return parse()
+
+    entry = os.path.join(config.CACHEPATH, cache_key(path, columns))
+    try:
+        with open(os.path.join(entry, 'meta.json'), 'r') as f:
+            names = json.load(f)['columns']
+        data = {name: np.asarray(np.load(os.path.join(entry, f"{i}.npy"), mmap_mode='c'))
+                for i, name in enumerate(names)}
+        os.utime(os.path.join(entry, 'meta.json'))   # mark as recently used for eviction
+        return data
+    except (OSError, ValueError, KeyError):
+        pass
+
+    data = parse()
+    try:
+        store(entry, path, data)
+        evict(config.CACHE_SIZE_LIMIT, keep=entry)
+    except OSError as e:
+        print(f"Could not cache {path}: {e}")
+    return data
+
+def store(entry, path, data):
+    # Write to a temporary folder first so a crash (or another process or thread) never sees half an
+    # entry. The name is unique per thread, get_data() caches files from several threads at once.
+    tmp = f"{entry}.{os.getpid()}.{threading.get_ident()}.tmp"
+    os.makedirs(tmp, exist_ok=True)
+    for i, column in enumerate(data.values()):
+        np.save(os.path.join(tmp, f"{i}.npy"), np.ascontiguousarray(column), allow_pickle=False)
+    with open(os.path.join(tmp, 'meta.json'), 'w') as f:
+        json.dump({'source': os.path.abspath(path), 'columns': list(data)}, f)
+    try:
+        os.replace(tmp, entry)
+    except OSError:
+        shutil.rmtree(tmp, ignore_errors=True)   # another process cached it first
+
+def entry_size(entry):
+    return sum(os.path.getsize(os.path.join(entry, f)) for f in os.listdir(entry))
+
+def evict(size_limit, keep=None):
+    '''
+    Remove the least recently used cache entries until the cache is under 'size_limit' bytes.
+    The entry 'keep' is never removed.
+    '''
+    entries = []
+    for name in os.listdir(config.CACHEPATH):
+        if name.endswith('.tmp'):
+            continue
+        entry = os.path.join(config.CACHEPATH, name)
+        meta = os.path.join(entry, 'meta.json')
+        if os.path.isfile(meta):
+            entries.append((os.path.getmtime(meta), entry_size(entry), entry))
+
+    total = sum(size for _, size, _ in entries)
+    for _, size, entry in sorted(entries):
+        if total <= size_limit:
+            break
+        if os.path.abspath(entry) != os.path.abspath(keep or ''):
+            print(f"Evicting cached {entry}")
+            shutil.rmtree(entry, ignore_errors=True)
+            total -= size
+
+def clear():
+    shutil.rmtree(config.CACHEPATH, ignore_errors=True)
+
+def column_array(series):
+    # Text columns are stored as fixed width strings so they can be saved without pickling
+    if pd.api.types.is_numeric_dtype(series):
+        return series.to_numpy(copy=True)
+    return series.to_numpy(dtype=str)
+
+def read_csv(path):
+    '''
+    Cached equivalent of pd.read_csv(path) for csv files with a single header row.
+    '''
+    def parse():
+        df = pd.read_csv(path)
+        return {c: column_array(df[c]) for c in df}
+    return pd.DataFrame(load(path, ['*'], parse), copy=False)
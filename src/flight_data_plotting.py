@@ -2,6 +2,7 @@
 
 import matplotlib.pyplot as plt
 import plotting_utils as utils
+import parabola_analytics
 import analytics_config as config
 
 def plot_z_acceleration(accel, data, parabola_times, parabola_set):
@@ -43,7 +44,7 @@ def plot_z_acceleration(accel, data, parabola_times, parabola_set):
     plt.savefig(config.IMGPATH + filename, dpi=300, bbox_inches='tight')
 
 def plot_sensor_data(data, tank_set='All Tanks', parabola_set='All Parabolas', 
-        accel=0, parabola_times=0, states=0, raw_data=False):
+        accel=0, parabola_times=None, states=0, raw_data=False):
     '''
     Single plot showing the data for each load cell in the tank set chosen. 
     
@@ -86,7 +87,7 @@ def plot_sensor_data(data, tank_set='All Tanks', parabola_set='All Parabolas',
         utils.add_acceleration_data(ax2, accel, g_units=True)
     
     # Add parabola times
-    if(parabola_times != 0):
+    if(parabola_times is not None):
         utils.add_parabola_times(ax, parabola_times)
     
     # Add state settings bar
@@ -152,10 +153,10 @@ def detailed_parabola_plots(parabs, tank_set, accel=0, states=0, zero_to_parab_s
             # Plot data
             data_subset = utils.get_data_subset(tank_set, parabs[idx].data)
             for cell in data_subset:
-                ax.plot([t - t0 for t in cell.time], cell.readings, utils.cell_style(cell.num), label=cell.name, zorder=5, marker='o', markersize=2)
+                ax.plot(cell.time - t0, cell.readings, utils.cell_style(cell.num), label=cell.name, zorder=5, marker='o', markersize=2)
 
             # Add acceleration 
-            ax2.plot([t - t0 for t in accel.time], [a/-9.81 for a in accel.readings], 'k-', zorder=1)
+            ax2.plot(accel.time - t0, accel.readings / -9.81, 'k-', zorder=1)
             ax2.set_ylim(-0.05, 0.2)
 
             # Add parabola times
@@ -193,7 +194,7 @@ def detailed_parabola_plots(parabs, tank_set, accel=0, states=0, zero_to_parab_s
     plt.savefig(config.IMGPATH + filename, dpi=500, bbox_inches='tight')
 
 def detailed_parabola_ratio_plots(parabs, tank_set, accel=0, states=0, zero_to_parab_start=False, 
-        output_type="Ratio Plots"):
+        output_type="Ratio Plots", analytics=None):
     '''
     9 subplots, each showing the data for each fill parabola (25%,50%,75%) divided by the control 
     for its set.
@@ -225,41 +226,44 @@ def detailed_parabola_ratio_plots(parabs, tank_set, accel=0, states=0, zero_to_p
         output_type: A string. Determines what type of data to plot. Options are either the default ratio
         plot (test data/ control data), effective mass plot, or ratio plot with acceleration ration factored 
         in.
+        analytics: Optional parabola_analytics object (defined in parabola_analytics.py) of parabs, 
+            computed here if not given.
     '''
-    fig, axes = plt.subplots(nrows=3, ncols=3, figsize=(26,18))
-        
-    controls = parabs[0::4]
-    sets = [ parabs[1:4], parabs[5:8], parabs[9:] ]
-    
+    # Curves of every parabola against its set's control, on a common parabola relative time grid.
+    # One row per set (control parabola), one column per fill procedure.
+    analytics = analytics if analytics is not None else parabola_analytics.parabola_analytics(parabs)
+    tensor = analytics.tensor
+    sets = tensor.sets()
+    if len(sets) == 0:
+        print("No control parabola with fill parabolas to plot ratios against")
+        return
+    if len(tensor.grid) < 2:
+        print("Parabola windows share no time span to plot ratios over")
+        return
+    fig, axes = plt.subplots(nrows=len(sets), ncols=sets.shape[1], figsize=(26,6*len(sets)), squeeze=False)
     for row, axes_row in enumerate(axes):
-        control_parab = controls[row]
-        control_data = utils.get_data_subset(tank_set, control_parab.data)
         for col, ax in enumerate(axes_row):
+            p = sets[row][col]
+            if p < 0:
+                ax.set_visible(False)
+                continue
             ax2 = ax.twinx()
-            idx = col + row * 3
-            test_parab = sets[row][col]
+            test_parab = parabs[p]
             test_data = utils.get_data_subset(tank_set, test_parab.data)
             
             # If true, set t=0 to be when the parabola starts
             t0 = test_parab.start if zero_to_parab_start else 0
+            time = tensor.grid + test_parab.start - t0
             
             # Plot data
-            for test, ctrl in zip(test_data, control_data):
-                effective_mass = [tr/at - cr/ac for tr, at, cr, ac in zip(test.readings, test.accel, ctrl.readings, ctrl.accel)]
-                accel_ratio = [at/ac for at, ac in zip(test.accel, ctrl.accel)]
-                sensor_ratio = [t/c for t, c in zip(test.readings, ctrl.readings)]
-                sensor_accel_ratio = [s / a for s, a in zip(sensor_ratio, accel_ratio)]
-                print(effective_mass[0], effective_mass[-1])
-                print(sensor_ratio[0], sensor_ratio[-1])
-                # output = sensor_ratio
-                # output = effective_mass if (output_type == "Effective Mass") else sensor_ratio
-                # output = sensor_accel_ratio if (output_type == "Accel Ratio") else sensor_ratio
-                # ax.plot([t - t0 for t in test.time], output, utils.cell_style(test.num), label=test.name, zorder=5)
-                ax.plot([t - t0 for t in test.time], effective_mass, utils.cell_style(test.num), label=test.name, zorder=5)
+            for test, c in zip(test_data, tensor.channel_index(test_data)):
+                # output = analytics.curve(output_type)
+                # ax.plot(time, output[p, c], utils.cell_style(test.num), label=test.name, zorder=5)
+                ax.plot(time, analytics.effective_mass[p, c], utils.cell_style(test.num), label=test.name, zorder=5)
 
             ############## WIP ##################
             # Add acceleration 
-            ax2.plot([t - t0 for t in accel.time], [a/-9.81 for a in accel.readings], 'k-', zorder=1)
+            ax2.plot(accel.time - t0, accel.readings / -9.81, 'k-', zorder=1)
             ax2.set_ylim(-0.05, 0.2)
             #####################################
 
@@ -272,19 +276,19 @@ def detailed_parabola_ratio_plots(parabs, tank_set, accel=0, states=0, zero_to_p
                 utils.add_state_settings_bar(ax, states, ypos=1.145, bar_size=0.01, zero_time = t0)
             
             # Format x/y axes
-            ax.set_xlim(test.time[0] - t0, test.time[-1] - t0)
+            ax.set_xlim(time[0], time[-1])
             ylim = (0.8, 1.15)
             ylim = (-5e7, 5e7) if (output_type == "Effective Mass") else ylim
             ylim = (-5,5) if (output_type == "Accel Ratio") else ylim
             ax.set_ylim(ylim)
-            if (row == 2):
+            if (row == len(sets) - 1):
                 ax.set_xlabel("Time (s)", fontsize=utils.SIZE)
             if (col == 0):
                 ylabel = "Test Output/Control Output"
                 ylabel = "Effective Mass" if (output_type == "Effective Mass") else ylabel
                 ylabel = "Test/Control * Accel Ratio" if (output_type == "Accel Ratio") else ylabel
                 ax.set_ylabel(ylabel, fontsize=utils.SIZE-2)
-            if (col == 2):
+            if (col == sets.shape[1] - 1):
                 ax2.set_ylabel("Acceleration (g units)", fontsize=utils.SIZE, rotation=270, labelpad=15)
             
             # Format subplot axis
@@ -305,7 +309,8 @@ def detailed_parabola_ratio_plots(parabs, tank_set, accel=0, states=0, zero_to_p
     print(f"Plotting {filename}")
     plt.savefig(config.IMGPATH + filename, dpi=500, bbox_inches='tight')
 
-def detailed_parabola_accel_ratio_plots(parabs, tank_set, accel=0, states=0, zero_to_parab_start=False):
+def detailed_parabola_accel_ratio_plots(parabs, tank_set, accel=0, states=0, zero_to_parab_start=False,
+        analytics=None):
     '''
     9 subplots, each showing the data accelration for each fill parabola (25%,50%,75%) divided by 
     the control for its set.
@@ -334,31 +339,42 @@ def detailed_parabola_accel_ratio_plots(parabs, tank_set, accel=0, states=0, zer
             and ends.
         zero_to_parab_start: Boolean value. If set to true all plots will have their time-axis (x-axis) 
             set to zero at the time where the parabola of said plot starts.
+        analytics: Optional parabola_analytics object (defined in parabola_analytics.py) of parabs, 
+            computed here if not given.
     '''
-    fig, axes = plt.subplots(nrows=3, ncols=3, figsize=(26,18))
-        
-    controls = parabs[0::4]
-    sets = [ parabs[1:4], parabs[5:8], parabs[9:] ]
-    
+    # Curves of every parabola against its set's control, on a common parabola relative time grid.
+    # One row per set (control parabola), one column per fill procedure.
+    analytics = analytics if analytics is not None else parabola_analytics.parabola_analytics(parabs)
+    tensor = analytics.tensor
+    sets = tensor.sets()
+    if len(sets) == 0:
+        print("No control parabola with fill parabolas to plot ratios against")
+        return
+    if len(tensor.grid) < 2:
+        print("Parabola windows share no time span to plot ratios over")
+        return
+    fig, axes = plt.subplots(nrows=len(sets), ncols=sets.shape[1], figsize=(26,6*len(sets)), squeeze=False)
+    ctrl = tensor.control
     for row, axes_row in enumerate(axes):
-        control_parab = controls[row]
-        control_data = utils.get_data_subset(tank_set, control_parab.data)
         for col, ax in enumerate(axes_row):
+            p = sets[row][col]
+            if p < 0:
+                ax.set_visible(False)
+                continue
             ax2 = ax.twinx()
-            idx = col + row * 3
-            test_parab = sets[row][col]
+            test_parab = parabs[p]
             test_data = utils.get_data_subset(tank_set, test_parab.data)
             
             # If true, set t=0 to be when the parabola starts
             t0 = test_parab.start if zero_to_parab_start else 0
+            time = tensor.grid + test_parab.start - t0
             
             # Plot data
-            for test, ctrl in zip(test_data, control_data):
-                accel_ratio = [at/ac for at, ac in zip(test.accel, ctrl.accel)]
-                ax.plot([t - t0 for t in test.time], accel_ratio, 'k', marker='o', markersize=2, zorder=5)
-                ax2.plot([t - t0 for t in test.time], [a/-9.81 for a in test.accel], utils.cell_style(test.num), marker='o', markersize=2, zorder=5)
-                ax2.plot([t - t0 for t in test.time], [a/-9.81 for a in ctrl.accel], 'm', marker='o', markersize=2, zorder=5)
-            ax2.plot([t - t0 for t in accel.time], [a/-9.81 for a in accel.readings], 'k-', zorder=1)
+            for test, c in zip(test_data, tensor.channel_index(test_data)):
+                ax.plot(time, analytics.accel_ratio[p, c], 'k', marker='o', markersize=2, zorder=5)
+                ax2.plot(time, tensor.accel[p, c] / -9.81, utils.cell_style(test.num), marker='o', markersize=2, zorder=5)
+                ax2.plot(time, tensor.accel[ctrl[p], c] / -9.81, 'm', marker='o', markersize=2, zorder=5)
+            ax2.plot(accel.time - t0, accel.readings / -9.81, 'k-', zorder=1)
 
             # Add parabola times
             ax.axvline(x=test_parab.start - t0, linewidth=1.5, color='k', linestyle='--', zorder=10)
@@ -369,14 +385,14 @@ def detailed_parabola_accel_ratio_plots(parabs, tank_set, accel=0, states=0, zer
                 utils.add_state_settings_bar(ax, states, ypos=1.145, bar_size=0.01, zero_time = t0)
             
             # Format x/y axes
-            ax.set_xlim(test.time[0] - t0, test.time[-1] - t0)
+            ax.set_xlim(time[0], time[-1])
             ax.set_ylim(-10, 10)
             ax2.set_ylim(-0.05, 0.2)
-            if (row == 2):
+            if (row == len(sets) - 1):
                 ax.set_xlabel("Time (s)", fontsize=utils.SIZE)
             if (col == 0):
                 ax.set_ylabel("Test Accel/Control Accel", fontsize=utils.SIZE-2)
-            if (col == 2):
+            if (col == sets.shape[1] - 1):
                 ax2.set_ylabel("Acceleration (g units)", fontsize=utils.SIZE, rotation=270, labelpad=15)
             
             # Format subplot axis
@@ -0,0 +1,193 @@
+# Filename: flight_store.py  SRC: J.Coppens 2020
+
+import numpy as np
+import pandas as pd
+import io
+import json
+import os
+import shutil
+
+class processed_flight_data:
+    def __init__(self, n, name):
+        self.num = n
+        self.name = name
+        self.time = []
+        self.readings = []
+        self.accel = []
+
+def source_stamp(path):
+    '''
+    Size and modification time of the file at 'path', changes whenever the file is rewritten.
+    '''
+    stat = os.stat(path)
+    return {'path': os.path.abspath(path), 'size': stat.st_size, 'mtime_ns': stat.st_mtime_ns}
+
+def write_store(path, channels, source=None):
+    '''
+    Write channels (flight_data or processed_flight_data objects) to a columnar store at 'path'.
+
+    Every column of every channel (time, readings and accel if the channel has it) is saved as its
+    own .npy file, with the channel names and numbers in meta.json. The store is written to a
+    temporary folder first and then moved into place, so readers never see a half written store.
+    'source' is an optional csv file holding the same data, its source_stamp() is kept in meta.json
+    so open_processed_store() can tell when the csv file changed.
+    '''
+    tmp = path.rstrip('/\\') + '.tmp'
+    shutil.rmtree(tmp, ignore_errors=True)
+    os.makedirs(tmp)
+    meta = channel_layout(channels)
+    for i, channel in enumerate(channels):
+        for column in meta[i]['columns']:
+            np.save(os.path.join(tmp, f"{i}_{column}.npy"), np.ascontiguousarray(getattr(channel, column)))
+    with open(os.path.join(tmp, 'meta.json'), 'w') as f:
+        json.dump({'channels': meta, 'source': source_stamp(source) if source else None}, f, indent=4)
+
+    shutil.rmtree(path, ignore_errors=True)
+    os.replace(tmp, path.rstrip('/\\'))
+
+def channel_layout(channels):
+    return [{'name': channel.name, 'num': channel.num,
+             'columns': [c for c in ('time', 'readings', 'accel') if len(getattr(channel, c, [])) > 0]}
+            for channel in channels]
+
+def append_rows(path, values, start):
+    '''
+    Grow the .npy file at 'path' to hold 'values', writing only values[start:] over its rows from
+    'start' on and rewriting the header (np.save leaves room in it for the length to grow) in
+    place. Returns False, leaving the file as it is, when the file does not hold a shorter array of
+    the same dtype and row shape.
+    '''
+    values = np.ascontiguousarray(values)
+    with open(path, 'r+b') as f:
+        version = np.lib.format.read_magic(f)
+        if version == (1, 0):
+            shape, fortran_order, dtype = np.lib.format.read_array_header_1_0(f)
+        else:
+            shape, fortran_order, dtype = np.lib.format.read_array_header_2_0(f)
+        offset = f.tell()
+        if (fortran_order or dtype != values.dtype or shape[1:] != values.shape[1:]
+                or not 0 <= start <= shape[0] <= len(values)):
+            return False
+        header = io.BytesIO()
+        d = {'descr': np.lib.format.dtype_to_descr(dtype), 'fortran_order': False, 'shape': values.shape}
+        if version == (1, 0):
+            np.lib.format.write_array_header_1_0(header, d)
+        else:
+            np.lib.format.write_array_header_2_0(header, d)
+        if len(header.getvalue()) != offset:
+            return False
+        # rows first, so a reader never sees a length the file does not have yet
+        f.seek(offset + start * values[:1].nbytes)
+        f.write(values[start:].tobytes())
+        f.seek(0)
+        f.write(header.getvalue())
+    return True
+
+def append_store(path, channels, starts):
+    '''
+    Bring the store at 'path' (written by write_store()) up to date with 'channels' in place, for
+    channels that only grew since it was written. Only the rows of channel i from starts[i] on are
+    written, so the cost depends on the new (or changed) rows rather than on the length of the
+    flight. The store is rewritten with write_store() when it does not exist yet or its channels or
+    columns changed.
+    '''
+    try:
+        with open(os.path.join(path, 'meta.json'), 'r') as f:
+            meta = json.load(f)['channels']
+    except (OSError, ValueError, KeyError):
+        return write_store(path, channels)
+    if meta != channel_layout(channels):
+        return write_store(path, channels)
+    for i, (channel, start) in enumerate(zip(channels, starts)):
+        for column in meta[i]['columns']:
+            if not append_rows(os.path.join(path, f"{i}_{column}.npy"), getattr(channel, column), start):
+                return write_store(path, channels)
+
+def read_processed_csv(path):
+    '''
+    Read a processed_data.csv file (as written by parser.py) into processed_flight_data objects,
+    one per load cell followed by the states.
+    '''
+    df = pd.read_csv(path, header=[0,1])
+    names = [n[0] for n in [col for col in df][::3]]
+    data = [processed_flight_data(i, name) for i, name in enumerate(names)][:-1]
+    df.columns = df.columns.droplevel()
+    for i in range(0,len(df.columns)-2,3):
+        idx = int(i/3)
+        data[idx].time     = df[df.columns[i+0]].to_numpy()
+        data[idx].readings = df[df.columns[i+1]].to_numpy()
+        data[idx].accel    = df[df.columns[i+2]].to_numpy()
+
+    state_data = processed_flight_data(-1, "States")
+    state_data.time = df['Time_State'].to_numpy()
+    state_data.readings = np.rint(df['State'].to_numpy()).astype(np.int64)   # state codes, written as floats
+    return data + [state_data]
+
+class flight_store:
+    '''
+    Read side of a store written by write_store().
+
+    Columns are memory mapped, and every channel's time column doubles as its index: a time range
+    is located with a binary search, so slicing a window only reads the pages holding that window.
+    '''
+    def __init__(self, path):
+        self.path = path
+        with open(os.path.join(path, 'meta.json'), 'r') as f:
+            self.meta = json.load(f)['channels']
+        self.channels = [c['name'] for c in self.meta]
+        self.columns = {}
+
+    def column(self, i, column):
+        key = (i, column)
+        if key not in self.columns:
+            self.columns[key] = np.load(os.path.join(self.path, f"{i}_{column}.npy"), mmap_mode='r')
+        return self.columns[key]
+
+    def channel_indices(self, channels):
+        if channels is None:
+            return range(len(self.meta))
+        return [self.channels.index(c) for c in channels]
+
+    def index_range(self, channel, t0, t1):
+        '''
+        Sample index range [start, stop) of 'channel' with t0 <= time <= t1.
+        '''
+        time = self.column(self.channels.index(channel), 'time')
+        return np.searchsorted(time, t0, side='left'), np.searchsorted(time, t1, side='right')
+
+    def slice(self, t0, t1, channels=None):
+        '''
+        Samples with t0 <= time <= t1 of each channel in 'channels' (all channels by default), as
+        processed_flight_data objects whose columns are read only views into the store.
+        '''
+        result = []
+        for i in self.channel_indices(channels):
+            meta = self.meta[i]
+            start, stop = self.index_range(meta['name'], t0, t1)
+            channel = processed_flight_data(meta['num'], meta['name'])
+            for column in meta['columns']:
+                setattr(channel, column, self.column(i, column)[start:stop])
+            result.append(channel)
+        return result
+
+    def load(self, channels=None):
+        return self.slice(-np.inf, np.inf, channels)
+
+def open_processed_store(store_path, csv_path):
+    '''
+    Open the processed data store, building it from the processed csv file the first time (e.g.
+    when only the csv file was checked out) and rebuilding it whenever the csv file was rewritten
+    or edited since the store was written.
+    '''
+    meta = os.path.join(store_path, 'meta.json')
+    if not os.path.isfile(meta):
+        print(f"Building {store_path} from {csv_path}")
+        write_store(store_path, read_processed_csv(csv_path), source=csv_path)
+    elif os.path.isfile(csv_path):
+        with open(meta, 'r') as f:
+            source = json.load(f).get('source')
+        stamp = source_stamp(csv_path)
+        if source is None or (source['size'], source['mtime_ns']) != (stamp['size'], stamp['mtime_ns']):
+            print(f"Rebuilding {store_path}, {csv_path} changed")
+            write_store(store_path, read_processed_csv(csv_path), source=csv_path)
+    return flight_store(store_path)
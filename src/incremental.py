@@ -0,0 +1,300 @@
+# Filename: incremental.py  SRC: J.Coppens 2020
+
+import numpy as np
+import pandas as pd
+import analytics_config as config
+import parser
+import parabola_parser
+from flight_store import processed_flight_data, append_store
+from timeseries import column_buffer
+import io
+import os
+import time
+
+class tail_reader:
+    '''
+    Reads the rows appended to a csv file since the last call.
+
+    Remembers the byte offset of the last complete line it parsed, so every call only parses new
+    rows. A partially written last line is left for the next call.
+    '''
+    def __init__(self, path, columns):
+        self.path = path
+        self.columns = columns
+        self.offset = 0
+        self.positions = None
+
+    def read(self):
+        '''
+        Returns a list of arrays (one per column) holding the new rows.
+        '''
+        empty = [np.empty(0)] * len(self.columns)
+        if not os.path.isfile(self.path) or os.path.getsize(self.path) == self.offset:
+            return empty
+        if os.path.getsize(self.path) < self.offset:
+            raise RuntimeError(f"{self.path} was truncated, restart the incremental run")
+
+        with open(self.path, 'rb') as f:
+            f.seek(self.offset)
+            chunk = f.read()
+        chunk = chunk[:chunk.rfind(b'\n') + 1]
+        if self.positions is None:
+            if not chunk:
+                return empty
+            header, chunk = chunk.split(b'\n', 1)
+            self.offset += len(header) + 1
+            names = header.decode().rstrip('\r').split(',')
+            self.positions = [c if isinstance(c, int) else names.index(c) for c in self.columns]
+        self.offset += len(chunk)
+        if not chunk.strip():
+            return empty
+
+        order = sorted(self.positions)
+        df = pd.read_csv(io.BytesIO(chunk), header=None, usecols=order, float_precision='round_trip')
+        return [df.iloc[:, order.index(p)].to_numpy(copy=True) for p in self.positions]
+
+class accel_stream:
+    '''
+    Incremental version of parser.process_accel(). Carries the last timestamp (for duplicate
+    removal across chunks) and the smoothing filter state between updates. The smoothed accel is
+    fed to a parabola_detector, and the parabola start/end events of the last update are kept in
+    'events'.
+
+    Accel data arrives while the flight runs, before there is enough of it to estimate the
+    offset, so the offset parser.get_data() saved for the flight is used (see
+    parser.accel_offset()), config.OFFSET_FALLBACK if there is none, unless 'offset' is given.
+    '''
+    def __init__(self, path, offset=None, datapath=config.DATAPATH):
+        self.reader = tail_reader(path, [config.ACCEL_TIME_COLUMN, config.ACCEL_COLUMN])
+        self.smoother = parser.exponential_filter(0.2)
+        self.detector = parabola_parser.parabola_detector()
+        self.events = []
+        self.t_last = None
+        self.t0 = None
+        self.offset = offset if offset is not None else parser.accel_offset(datapath, path, estimate=False)
+        self.time = column_buffer()
+        self.readings = column_buffer()
+
+    def update(self):
+        self.events = []
+        t, a = self.reader.read()
+        if len(t) == 0:
+            return 0
+        # Duplicates of the last timestamp of the previous chunk
+        if self.t_last is not None:
+            new = np.flatnonzero(t != self.t_last)
+            start = new[0] if len(new) else len(t)
+            t, a = t[start:], a[start:]
+        t, a, _ = parser.remove_duplicate_times(t, a)
+        if len(t) == 0:
+            return 0
+        self.t_last = t[-1]
+        if self.t0 is None:
+            self.t0 = t[0] + self.offset
+        t, a = t - self.t0, self.smoother(a)
+        self.time.append(t)
+        self.readings.append(a)
+        self.events = self.detector(t, a)
+        return len(t)
+
+class cell_stream:
+    '''
+    Incremental version of parser.process_cell(). Carries the filter_readings() context (last two
+    filtered samples and the last unfiltered reading), the zero reading and the downsample phase
+    (last kept time) between updates. Accel values of samples past the end of the accel data are
+    matched again once more accel data arrives, only against the accel samples they can be
+    closest to, and 'stored' / 'raw_stored' count the rows already written that will not change.
+    Rows past the end of the accel data are looked up and written again on every update until
+    they are matched.
+    '''
+    def __init__(self, name, n, path, cutoff=100000):
+        self.name = name
+        self.num = n
+        self.cutoff = cutoff
+        self.reader = tail_reader(path, [0, 1])
+        self.pending = []
+        self.last_reading = None
+        self.context_time = np.empty(0)
+        self.context_readings = np.empty(0)
+        self.d0 = None
+        self.t_prev = -1
+        self.matched = 0
+        self.stored = 0
+        self.raw_stored = 0
+        self.raw_time, self.raw_readings = column_buffer(), column_buffer()
+        self.time, self.readings, self.accel = column_buffer(), column_buffer(), column_buffer()
+
+    def read(self):
+        t, y = self.reader.read()
+        if len(t):
+            self.pending.append((t, y))
+        return len(t)
+
+    def first_time(self):
+        return self.pending[0][0][0] if self.pending else None
+
+    def update(self, t0, accel):
+        if not self.pending:
+            self.match(accel)
+            return 0
+        t = np.concatenate([p[0] for p in self.pending]) - t0
+        y = np.concatenate([p[1] for p in self.pending])
+        self.pending = []
+
+        # filter_readings() on the new rows, with the last two filtered samples in front
+        spikes = np.abs(np.diff(y if self.last_reading is None else np.r_[self.last_reading, y])) > self.cutoff
+        spikes = np.flatnonzero(spikes) + (1 if self.last_reading is None else 0)
+        self.last_reading = y[-1]
+        k = len(self.context_time)
+        t_ext, y_ext = np.r_[self.context_time, t], np.r_[self.context_readings, y].astype(y.dtype)
+        for i in spikes + k:
+            y_ext[i] = y_ext[i-2] + ((y_ext[i-1]-y_ext[i-2])/(t_ext[i-1]-t_ext[i-2]))*(t_ext[i]-t_ext[i-2])
+        y = y_ext[k:]
+        self.context_time, self.context_readings = t_ext[-2:], y_ext[-2:]
+        self.raw_time.append(t)
+        self.raw_readings.append(y)
+
+        # zero_readings() and downsample()
+        if self.d0 is None:
+            self.d0 = y[0]
+        keep = parser.min_spacing_mask(t, 0.59, self.t_prev)
+        if keep.any():
+            self.t_prev = t[keep][-1]
+        self.time.append(t[keep])
+        self.readings.append(y[keep] - self.d0)
+        self.accel.append(np.full(keep.sum(), np.nan))
+        self.match(accel)
+        return keep.sum()
+
+    def match(self, accel):
+        # Samples past the end of the accel data have not found their nearest accel value yet
+        if accel.time.size == 0 or self.matched == self.time.size:
+            return
+        time = self.time.data[self.matched:]
+        # only the accel samples from the one at or before the first unmatched time to the one at or
+        # after the last can be the closest
+        first = max(np.searchsorted(accel.time.data, time[0], side='right') - 1, 0)
+        last = np.searchsorted(accel.time.data, time[-1], side='left') + 1
+        self.accel.data[self.matched:] = parser.align_to(time, accel.time.data[first:last],
+                                                         accel.readings.data[first:last])
+        self.matched += np.searchsorted(time, accel.time.data[-1], side='right')
+
+class state_stream:
+    '''
+    Incremental version of parser.process_states(), carrying the downsample phase.
+    '''
+    def __init__(self, path):
+        self.name = 'States'
+        self.num = -1
+        self.reader = tail_reader(path, [0, 1])
+        self.pending = []
+        self.t_prev = -1
+        self.stored = 0
+        self.time, self.readings = column_buffer(), column_buffer(np.int64)
+
+    def read(self):
+        t, s = self.reader.read()
+        if len(t):
+            self.pending.append((t, s))
+        return len(t)
+
+    def update(self, t0):
+        if not self.pending:
+            return 0
+        t = np.concatenate([p[0] for p in self.pending]) - t0
+        states = parser.state_codes(np.concatenate([p[1].astype(str) for p in self.pending]))
+        self.pending = []
+        keep = parser.min_spacing_mask(t, 0.59, self.t_prev)
+        if keep.any():
+            self.t_prev = t[keep][-1]
+        self.time.append(t[keep])
+        self.readings.append(states[keep])
+        return keep.sum()
+
+class incremental_run:
+    '''
+    Keeps the processed data of one run folder up to date as the laptop logger appends to it.
+
+    Every update() only parses and processes the rows appended since the previous one, so the
+    processed and raw data stores (see flight_store.py) can be refreshed after every parabola
+    instead of rebuilding them with parser.get_data().
+
+    Args:
+        datapath: Run folder, e.g. config.DATAPATH.
+        outpath: Folder the processed_data/ and raw_data/ stores are written to.
+    '''
+    def __init__(self, datapath, outpath=config.OUTPATH, accel_path=config.ACCEL_DATA):
+        self.datapath = datapath
+        self.outpath = outpath
+        self.t0 = None
+        self.accel = accel_stream(accel_path, datapath=datapath)
+        self.states = state_stream(os.path.join(datapath, 'state.csv'))
+        self.cells = [cell_stream(name, n, os.path.join(datapath, filename))
+                      for name, n, filename in parser.LOADCELLS]
+
+    def update(self):
+        '''
+        Process newly appended rows. Returns the number of new processed samples.
+        '''
+        self.accel.update()
+        for stream in self.cells + [self.states]:
+            stream.read()
+        if self.t0 is None:
+            self.t0 = self.cells[0].first_time()
+            if self.t0 is None:
+                return 0
+        new = sum(cell.update(self.t0, self.accel) for cell in self.cells)
+        return new + self.states.update(self.t0)
+
+    def channels(self, raw=False):
+        result = []
+        for stream in self.cells:
+            channel = processed_flight_data(stream.num, stream.name)
+            if raw:
+                channel.time, channel.readings = stream.raw_time.data, stream.raw_readings.data
+            else:
+                channel.time, channel.readings, channel.accel = stream.time.data, stream.readings.data, stream.accel.data
+            result.append(channel)
+        states = processed_flight_data(self.states.num, self.states.name)
+        states.time, states.readings = self.states.time.data, self.states.readings.data
+        return result + [states]
+
+    def write(self):
+        '''
+        Write the rows added (or matched to accel data) since the last write() to the stores.
+        '''
+        append_store(os.path.join(self.outpath, 'processed_data'), self.channels(),
+                     [cell.stored for cell in self.cells] + [self.states.stored])
+        append_store(os.path.join(self.outpath, 'raw_data'), self.channels(raw=True),
+                     [cell.raw_stored for cell in self.cells] + [self.states.stored])
+        for cell in self.cells:
+            cell.stored, cell.raw_stored = cell.matched, cell.raw_time.size
+        self.states.stored = self.states.time.size
+
+def find_runs(root):
+    return sorted(name for name in os.listdir(root)
+                  if os.path.isfile(os.path.join(root, name, 'load_cell_0_readings.csv')))
+
+def watch(root=config.DATAROOT, interval=1.0):
+    '''
+    Poll 'root' for run folders, starting an incremental_run for every new folder and updating
+    every run (and its stores in OUTPATH/<run folder>/) whenever rows are appended.
+    '''
+    runs = {}
+    while True:
+        for name in find_runs(root):
+            if name not in runs:
+                print(f"Watching new run folder {name}")
+                runs[name] = incremental_run(os.path.join(root, name), os.path.join(config.OUTPATH, name))
+        for name, run in runs.items():
+            start = time.perf_counter()
+            new = run.update()
+            for event, num, t, _ in run.accel.events:
+                print(f"{name}: parabola {num} {event} at {t:.2f} s")
+            if new:
+                run.write()
+                print(f"{name}: {new} new samples processed in {1000*(time.perf_counter() - start):.1f} ms")
+        time.sleep(interval)
+
+if __name__ == "__main__":
+    watch()
@@ -0,0 +1,68 @@
+# Filename: lazy_csv.py  SRC: J.Coppens 2020
+
+import data_cache
+import numpy as np
+import pandas as pd
+import csv
+import re
+
+def attribute_name(column):
+    '''
+    Attribute name used for a csv column, e.g. 'Az (m/s^2)' -> 'az_m_s_2'
+    '''
+    return re.sub(r'\W+', '_', column).strip('_').lower()
+
+class lazy_csv:
+    '''
+    Csv file whose columns are only parsed when they are first accessed.
+
+    The header is read once when the object is created. Columns can then be accessed by name
+    (data['Az (m/s^2)']), by position (data[12]) or as attributes (data.az_m_s_2). Each column
+    is parsed on its own (through data_cache) so wide files like the NRC FlightData.csv only pay
+    for the channels an analysis actually uses.
+    '''
+    def __init__(self, path):
+        self.path = path
+        with open(path, 'r', newline='') as f:
+            self.columns = next(csv.reader(f))
+        self.attributes = {attribute_name(c): c for c in self.columns}
+        self.loaded = {}
+
+    def column_name(self, column):
+        if isinstance(column, (int, np.integer)):
+            return self.columns[column]
+        if column not in self.columns:
+            raise KeyError(f"'{column}' is not a column of {self.path}")
+        return column
+
+    def load(self, *columns):
+        '''
+        Parse all of 'columns' that are not loaded yet in a single pass over the file.
+        '''
+        names = [self.column_name(c) for c in columns]
+        missing = [n for n in dict.fromkeys(names) if n not in self.loaded]
+        if missing:
+            positions = sorted(self.columns.index(n) for n in missing)
+            def parse():
+                df = pd.read_csv(self.path, usecols=positions, float_precision='round_trip')
+                return {self.columns[p]: data_cache.column_array(df.iloc[:, i]) for i, p in enumerate(positions)}
+            self.loaded.update(data_cache.load(self.path, [self.columns[p] for p in positions], parse))
+        return [self.loaded[n] for n in names]
+
+    def __getitem__(self, column):
+        return self.load(column)[0]
+
+    def __setitem__(self, column, values):
+        self.loaded[self.column_name(column)] = values
+
+    def __getattr__(self, attr):
+        attributes = self.__dict__.get('attributes', {})
+        if attr not in attributes:
+            raise AttributeError(attr)
+        return self[attributes[attr]]
+
+    def __dir__(self):
+        return list(super().__dir__()) + list(self.attributes)
+
+    def __len__(self):
+        return len(self[0])
@@ -0,0 +1,245 @@
+# Filename: offset_estimation.py  SRC: J.Coppens 2020
+
+import numpy as np
+import copy
+import json
+import os
+import scipy.fft
+import analytics_config as config
+
+# One row per load cell, see estimate_offsets()
+OFFSET_DTYPE = np.dtype([
+    ('channel', 'U20'),
+    ('offset', np.float64),         # seconds, accel time - first accel time - offset = cell time
+    ('correlation', np.float64),    # correlation of the readings and accel at 'offset' (-1 to 1)
+    ('significance', np.float64),   # how far the peak stands out from the other lags (see peak())
+])
+
+def resample(time, values, t0, n, step):
+    '''
+    Means of 'values' in the n bins of 'step' seconds starting at t0. Empty bins are interpolated
+    from their neighbours.
+    '''
+    time = np.asarray(time, dtype=np.float64)
+    bins = np.floor((time - t0) / step).astype(np.int64)
+    inside = (bins >= 0) & (bins < n)
+    bins = bins[inside]
+    counts = np.bincount(bins, minlength=n)
+    sums = np.bincount(bins, weights=np.asarray(values, dtype=np.float64)[inside], minlength=n)
+    filled = counts > 0
+    centers = np.arange(n)
+    if not filled.any():
+        return np.zeros(n)
+    return np.interp(centers, centers[filled], sums[filled] / counts[filled])
+
+def highpass(x, width):
+    '''
+    'x' (1-D or (channel, sample)) minus its centered running mean over 'width' samples, which
+    removes slow drift (e.g. load cell temperature drift) but keeps the parabolas.
+    '''
+    if width <= 1:
+        return x - x.mean(axis=-1, keepdims=True)
+    n = x.shape[-1]
+    P = np.zeros(x.shape[:-1] + (n + 1,))
+    np.cumsum(x, axis=-1, out=P[..., 1:])
+    i = np.arange(n)
+    lo, hi = np.maximum(i - width//2, 0), np.minimum(i + width//2 + 1, n)
+    return x - (P[..., hi] - P[..., lo]) / (hi - lo)
+
+def peak(strength):
+    '''
+    Peak of correlation strengths (|correlation| per lag, last axis) refined to a fraction of a
+    step with a parabola through the peak and its two neighbours, and its significance: the
+    height of the peak above the median strength in robust standard deviations (1.4826 * median
+    absolute deviation) of all lags. Correlating unrelated signals gives significances up to ~7,
+    see config.OFFSET_MIN_SIGNIFICANCE.
+
+    Returns:
+        (index, shift, significance), shift in lags (-0.5 to 0.5).
+    '''
+    k = np.argmax(strength, axis=-1)
+    n = strength.shape[-1]
+    take = lambda i: np.take_along_axis(strength, np.expand_dims(i, -1), axis=-1)[..., 0]
+    left, mid, right = take(np.maximum(k - 1, 0)), take(k), take(np.minimum(k + 1, n - 1))
+    curvature = left - 2*mid + right
+    inner = (k > 0) & (k < n - 1) & (curvature < 0)
+    median = np.median(strength, axis=-1)
+    spread = 1.4826 * np.median(np.abs(strength - np.expand_dims(median, -1)), axis=-1)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        shift = np.where(inner, 0.5*(left - right)/curvature, 0.0)
+        significance = np.where(spread > 0, (mid - median)/spread, 0.0)
+    return k, shift, significance
+
+def estimate_offsets(cell_times, cell_readings, accel_time, accel, names=None, step=config.OFFSET_STEP,
+                     min_overlap=config.OFFSET_MIN_OVERLAP, drift=config.OFFSET_DRIFT_WINDOW,
+                     workers=config.WORKERS):
+    '''
+    Time offset between the load cells and the acceleration, from the cross-correlation of their
+    readings.
+
+    All signals are binned onto 'step' second grids, the cells from their common (zeroed) start
+    and the accel from its first time, and drift slower than 'drift' seconds is removed. The
+    cross-correlation of every cell with the accel, for every lag, comes from one batched FFT over
+    all cells (run on 'workers' threads). Prefix sums turn it into the correlation coefficient of
+    the overlapping part at each lag, so lags where only part of the records overlap are not
+    penalized. Every cell gets the peak of its own |correlation|, the flight offset is the peak
+    of the mean |correlation| of all cells, since they share one offset (see peak()).
+
+    Args:
+        cell_times, cell_readings: Lists with the times and readings of each load cell, times
+            zeroed to the same t0 (the offsets are relative to it, the cells may start later).
+        accel_time, accel: Raw acceleration times (without duplicates) and readings.
+        names: Optional channel names.
+        min_overlap: Fraction of the shorter record that has to overlap at a lag for it to count.
+
+    Returns:
+        (offset, significance, estimates), the per cell estimates as an OFFSET_DTYPE array.
+    '''
+    C = len(cell_times)
+    names = names if names is not None else [str(i) for i in range(C)]
+    start = min(t[0] for t in cell_times)
+    Lc = int(np.floor((max(t[-1] for t in cell_times) - start) / step)) + 1
+    La = int(np.floor((accel_time[-1] - accel_time[0]) / step)) + 1
+    cells = np.empty((C, Lc))
+    for j in range(C):
+        cells[j] = resample(cell_times[j], cell_readings[j], start, Lc, step)
+    acc = resample(accel_time, accel, accel_time[0], La, step)
+    width = int(round(drift / step)) if drift else 0
+    cells = highpass(cells, width)
+    acc = highpass(acc, width)
+
+    # sum of cells[:, i] * acc[i + k] for every lag k, negative lags wrap around to the end
+    n = scipy.fft.next_fast_len(Lc + La - 1, real=True)
+    spectrum = np.conj(scipy.fft.rfft(cells, n, axis=1, workers=workers))
+    spectrum *= scipy.fft.rfft(acc, n, workers=workers)
+    products = scipy.fft.irfft(spectrum, n, axis=1, workers=workers)
+
+    m = max(int(np.ceil(min_overlap * min(Lc, La))), 3)
+    lags = np.arange(-(Lc - m), La - m + 1)
+    Sca = products[:, lags % n]
+
+    # sums over the overlapping samples: cells[i0:i1] against acc[i0+k:i1+k]
+    i0 = np.maximum(0, -lags)
+    i1 = np.minimum(Lc, La - lags)
+    count = i1 - i0
+    Pc = np.zeros((C, Lc + 1)); np.cumsum(cells, axis=1, out=Pc[:, 1:])
+    Pcc = np.zeros((C, Lc + 1)); np.cumsum(cells*cells, axis=1, out=Pcc[:, 1:])
+    Pa = np.zeros(La + 1); np.cumsum(acc, out=Pa[1:])
+    Paa = np.zeros(La + 1); np.cumsum(acc*acc, out=Paa[1:])
+    Sc, Scc = Pc[:, i1] - Pc[:, i0], Pcc[:, i1] - Pcc[:, i0]
+    Sa, Saa = Pa[i1 + lags] - Pa[i0 + lags], Paa[i1 + lags] - Paa[i0 + lags]
+    with np.errstate(invalid='ignore', divide='ignore'):
+        r = (Sca - Sc*Sa/count) / np.sqrt((Scc - Sc*Sc/count) * (Saa - Sa*Sa/count))
+    r = np.nan_to_num(r)
+    strength = np.abs(r)
+
+    estimates = np.zeros(C, dtype=OFFSET_DTYPE)
+    estimates['channel'] = names
+    k, shift, significance = peak(strength)
+    # cell sample i is at start + i*step and lines up with accel sample i + lag
+    estimates['offset'] = (lags[k] + shift) * step - start
+    estimates['correlation'] = r[np.arange(C), k]
+    estimates['significance'] = significance
+
+    k, shift, significance = peak(strength.mean(axis=0))
+    return (lags[k] + shift) * step - start, float(significance), estimates
+
+def estimate_offset(cells, accel, **kwargs):
+    '''
+    Offset (in seconds) of a flight's acceleration data, for accel_data.zero_times(accel_data.time[0]
+    + offset).
+
+    Args:
+        cells: Load cell flight_data objects, times zeroed to the same t0 (e.g. the first load cell
+            time) or not zeroed at all.
+        accel: Raw acceleration flight_data object, duplicate times removed.
+        kwargs: See estimate_offsets().
+
+    Returns:
+        (offset, significance, estimates), see estimate_offsets().
+    '''
+    t0 = cells[0].time[0]
+    readings = []
+    for cell in cells:
+        # repair spikes like parser.process_cell() does, on a copy
+        filtered = copy.copy(cell)
+        filtered.readings = np.array(cell.readings, dtype=np.float64)
+        filtered.filter_readings()
+        readings.append(filtered.readings)
+    return estimate_offsets([cell.time - t0 for cell in cells], readings, accel.time, accel.readings,
+                            [cell.name for cell in cells], **kwargs)
+
+def print_estimates(offset, significance, estimates):
+    for e in estimates:
+        print(f"  {e['channel']:<20} offset {e['offset']:9.3f} s  correlation {e['correlation']:6.3f}"
+              f"  significance {e['significance']:5.1f}")
+    print(f"Accel offset {offset:.3f} s (significance {significance:.1f})")
+
+def write_offset(offset, significance, estimates, used, path=config.OFFSET_FILE,
+                 datapath=config.DATAPATH, accel_path=config.ACCEL_DATA):
+    '''
+    Save the offset estimate of the flight in 'datapath' / 'accel_path' next to the offset 'used'
+    for it and the calibrated config.OFFSET, see read_offset().
+    '''
+    os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+    with open(path, 'w') as f:
+        f.write(json.dumps({
+            "datapath": os.path.abspath(datapath),
+            "accel_data": os.path.abspath(accel_path),
+            "offset": float(used),
+            "calibrated": config.OFFSET,
+            "estimate": float(offset),
+            "significance": float(significance),
+            "loadcells": [{
+                "loadcell": str(e["channel"]),
+                "offset": float(e["offset"]),
+                "correlation": float(e["correlation"]),
+                "significance": float(e["significance"])
+            } for e in estimates]
+        }, indent=4))
+
+def save_offset(offset, significance, estimates, path=config.OFFSET_FILE, datapath=config.DATAPATH,
+                accel_path=config.ACCEL_DATA):
+    '''
+    Pick the offset to use for an estimate and save both with write_offset(): the calibrated
+    config.OFFSET if it is set, with a warning when a significant estimate disagrees with it,
+    otherwise the estimate, or config.OFFSET_FALLBACK if it is not significant.
+
+    Returns:
+        The offset to use.
+    '''
+    significant = significance >= config.OFFSET_MIN_SIGNIFICANCE
+    if config.OFFSET is not None:
+        used = config.OFFSET
+        if significant and abs(offset - config.OFFSET) > config.OFFSET_TOLERANCE:
+            print(f"WARNING: estimated offset {offset:.3f} s (significance {significance:.1f}) differs from the "
+                  f"calibrated offset of {config.OFFSET} s, using the calibrated offset")
+    elif significant:
+        used = offset
+    else:
+        print(f"Offset estimate not significant, using the fallback offset of {config.OFFSET_FALLBACK} s")
+        used = config.OFFSET_FALLBACK
+    write_offset(offset, significance, estimates, used, path, datapath, accel_path)
+    return used
+
+def read_offset(path=config.OFFSET_FILE, datapath=config.DATAPATH, accel_path=config.ACCEL_DATA):
+    '''
+    Offset saved by write_offset() for the flight in 'datapath' / 'accel_path', None if there is
+    none.
+    '''
+    try:
+        with open(path, 'r') as f:
+            saved = json.load(f)
+    except (OSError, ValueError):
+        return None
+    if (saved.get("datapath"), saved.get("accel_data")) != (os.path.abspath(datapath), os.path.abspath(accel_path)):
+        return None
+    return saved.get("offset")
+
+if __name__ == "__main__":
+    import parser
+    cells = [parser.flight_data(name, n, 'load_cell', config.DATAPATH + filename)
+             for name, n, filename in parser.LOADCELLS]
+    accel = parser.load_accel()
+    accel.remove_duplicate_times()
+    print_estimates(*estimate_offset(cells, accel))
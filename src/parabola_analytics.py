@@ -0,0 +1,147 @@
+# Filename: parabola_analytics.py  SRC: J.Coppens 2020
+
+import numpy as np
+import analytics_config as config
+import parabola_parser
+from csv_writer import write_csv
+
+# One row per parabola and channel, see parabola_analytics
+ANALYTICS_DTYPE = np.dtype([
+    ('num', np.int32),              # parabola number
+    ('procedure', 'U12'),           # 'Control', 'Fill 25%', ...
+    ('channel_num', np.int32),
+    ('channel', 'U20'),
+    ('start', np.float64),          # parabola start/end time
+    ('end', np.float64),
+    ('samples', np.int64),          # channel samples between start and end
+    ('mean', np.float64),           # readings between start and end
+    ('slope', np.float64),          # least squares slope of the readings (per second)
+    ('min', np.float64),
+    ('max', np.float64),
+    ('settle_time', np.float64),    # seconds from the start until the readings stay settled
+    ('sensor_ratio', np.float64),   # means over the parabola of the curves against the control
+    ('accel_ratio', np.float64),
+    ('effective_mass', np.float64),
+])
+
+def segment_stats(time, readings, starts, ends, band=config.SETTLE_BAND):
+    '''
+    Statistics of the readings in every time segment [starts[i], ends[i]] of one channel.
+
+    Segments must be sorted and must not overlap. Every statistic is a segment reduction
+    (ufunc.reduceat) over the channel, so all segments are handled in one pass.
+
+    Returns:
+        Dict of arrays with one value per segment: samples, mean, slope, min, max and
+        settle_time, the time from the segment start until the readings last left a band of
+        'band' times the segment's range around its final reading. NaN for empty segments.
+    '''
+    time = np.asarray(time, dtype=np.float64)
+    y = np.asarray(readings, dtype=np.float64)
+    lo = np.searchsorted(time, starts, side='left')
+    hi = np.searchsorted(time, ends, side='right')
+    n = hi - lo
+    empty = n == 0
+
+    # reduceat over [lo0, hi0, lo1, hi1, ...], every other result is a segment. A padding sample
+    # keeps every index valid when a segment runs to the end of the channel.
+    bounds = np.ravel(np.column_stack((lo, hi)))
+    def reduce(ufunc, values):
+        return ufunc.reduceat(np.r_[values, 0], bounds)[::2]
+
+    t = time - time[np.minimum(lo, len(time) - 1)].mean() if len(time) else time   # centered, for accurate sums
+    with np.errstate(invalid='ignore', divide='ignore'):
+        St, Sy = reduce(np.add, t), reduce(np.add, y)
+        Stt, Sty = reduce(np.add, t*t), reduce(np.add, t*y)
+        stats = {
+            'samples': n,
+            'mean': Sy / n,
+            'slope': (n*Sty - St*Sy) / (n*Stt - St*St),
+            'min': reduce(np.minimum, y).astype(np.float64),
+            'max': reduce(np.maximum, y).astype(np.float64),
+        }
+
+        # segment of every sample (-1 outside of all segments)
+        seg = np.searchsorted(lo, np.arange(len(y)), side='right') - 1
+        inside = (seg >= 0) & (np.arange(len(y)) < hi[np.maximum(seg, 0)])
+        seg = np.where(inside, seg, -1)
+        final = y[np.maximum(hi - 1, 0)]
+        tolerance = band * (stats['max'] - stats['min'])
+        unsettled = inside & (np.abs(y - final[seg]) > tolerance[seg])
+        last = reduce(np.maximum, np.where(unsettled, np.arange(len(y)), -1))
+        settled = np.where(last < 0, lo, np.minimum(last + 1, hi - 1))
+        stats['settle_time'] = time[np.minimum(settled, len(time) - 1)] - np.asarray(starts)
+
+    for key in ('mean', 'slope', 'min', 'max', 'settle_time'):
+        stats[key][empty] = np.nan
+    return stats
+
+class parabola_analytics:
+    '''
+    Per parabola analytics of the sensor data, for all parabolas and channels at once.
+
+    The curves effective_mass, sensor_ratio, accel_ratio and sensor_accel_ratio are
+    [parabola, channel, t] arrays on the parabola_tensor grid, each parabola against the control
+    parabola of its set. 'table' (ANALYTICS_DTYPE) summarizes every parabola and channel: the
+    statistics of the full rate channel data between the parabola start and end (see
+    segment_stats()) and the means of the curves over the same time.
+
+    Args:
+        parabs: List of parabola objects, as returned by parabola_parser.get_parabola_sets().
+        tensor: Optional parabola_tensor of 'parabs', built if not given.
+    '''
+    def __init__(self, parabs, tensor=None):
+        self.parabs = parabs
+        self.tensor = tensor if tensor is not None else parabola_parser.parabola_tensor(parabs)
+        T = self.tensor
+        ctrl = T.control
+        with np.errstate(invalid='ignore', divide='ignore'):
+            self.effective_mass = T.readings/T.accel - T.readings[ctrl]/T.accel[ctrl]
+            self.sensor_ratio = T.readings / T.readings[ctrl]
+            self.accel_ratio = T.accel / T.accel[ctrl]
+            self.sensor_accel_ratio = self.sensor_ratio / self.accel_ratio
+
+        P, C = len(parabs), len(T.channels)
+        table = np.zeros((P, C), dtype=ANALYTICS_DTYPE)
+        table['num'] = T.nums[:,None]
+        table['procedure'] = np.array(T.procedures)[:,None]
+        table['channel_num'] = T.channel_nums
+        table['channel'] = T.channels
+        table['start'] = T.starts[:,None]
+        table['end'] = T.ends[:,None]
+        for j, cell in enumerate(parabs[0].data):
+            stats = segment_stats(cell.channel.time, cell.channel.readings, T.starts, T.ends)
+            for key, values in stats.items():
+                table[key][:,j] = values
+
+        # means of the curves over each parabola
+        during = (T.grid >= 0) & (T.grid <= (T.ends - T.starts)[:,None])
+        for key in ('sensor_ratio', 'accel_ratio', 'effective_mass'):
+            curve = getattr(self, key)
+            valid = during[:,None,:] & np.isfinite(curve)
+            with np.errstate(invalid='ignore'):
+                table[key] = np.where(valid, curve, 0).sum(axis=2) / valid.sum(axis=2)
+        self.table = table.ravel()
+
+    def curve(self, output_type):
+        '''
+        Curve shown by the ratio plots for 'output_type' ('Effective Mass', 'Accel Ratio' or the
+        sensor ratio for anything else).
+        '''
+        if output_type == "Effective Mass":
+            return self.effective_mass
+        if output_type == "Accel Ratio":
+            return self.sensor_accel_ratio
+        return self.sensor_ratio
+
+    def write(self, path=config.PARABOLA_ANALYTICS):
+        columns = [self.table[name] for name in self.table.dtype.names]
+        formats = ['%d', '%s', '%d', '%s', '%.4f', '%.4f', '%d'] + ['%.6g'] * 8
+        return write_csv(path, [','.join(self.table.dtype.names)], columns, formats)
+
+if __name__ == "__main__":
+    import plotting_utils as utils
+    data, state_data, accel_data, parabola_times, parabola_data = utils.read_in_data()
+    analytics = parabola_analytics(parabola_data)
+    analytics.write()
+    print(f"Wrote {len(analytics.table)} rows to {config.PARABOLA_ANALYTICS}")
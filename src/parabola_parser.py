@@ -3,68 +3,315 @@
 import numpy as np
 import parser
 import analytics_config as config
-import copy
-import math
+from csv_writer import write_csv
+from timeseries import nearest_index
 
-def find_parabolas(data):
-    parabolas = [[], [], [], []]
-    t0 = 0
-    i = 1
-    for t, a in zip(data.time, data.readings):
-        if(abs(a) < config.MICRO_G_ENTRY_THRESHOLD and t0==0):
-            t0 = t
-        if(abs(a) > config.MICRO_G_EXIT_THRESHOLD and t0>0 and t-t0 > 10):
-            #print(f"{i:2d} {t-t0:5.2f} {t0:7.2f} {t:7.2f}")
-            parabolas[0].append(i)      #parabola number
-            parabolas[1].append(t0)     #start time
-            parabolas[2].append(t)      #end time
-            parabolas[3].append(t0 - t) #duration
-            t0 = 0
+# Procedures of the test parabolas of a set, in the order the ratio plots show them
+FILL_PROCEDURES = ['Fill 25%', 'Fill 50%', 'Fill 75%']
+
+# One row per parabola, see detect_parabolas()
+PARABOLA_DTYPE = np.dtype([
+    ('num', np.int32),          # parabola number, starting at 1
+    ('start', np.float64),      # start time
+    ('end', np.float64),        # end time
+    ('duration', np.float64),   # end - start
+    ('start_index', np.int64),  # index of the first micro-g sample
+    ('end_index', np.int64),    # index of the sample that ended the parabola
+])
+
+def detect_parabolas(time, accel, entry=config.MICRO_G_ENTRY_THRESHOLD,
+        exit=config.MICRO_G_EXIT_THRESHOLD, min_time=config.MIN_PARABOLA_TIME):
+    '''
+    Find the micro-g windows in an acceleration series.
+
+    A parabola starts at the first sample with |accel| < entry and ends at the first sample with
+    |accel| > exit at least min_time seconds after the start (exit crossings before that are
+    ignored). The next parabola can only start after the end of the previous one. Only the
+    entry/exit crossings are looked at, with a binary search per parabola, so this takes a few
+    milliseconds on full rate accel data.
+
+    Args:
+        time: Sorted (non-decreasing) sample times.
+        accel: Acceleration samples, the sign does not matter.
+
+    Returns:
+        Structured array with PARABOLA_DTYPE, one row per parabola.
+    '''
+    time = np.asarray(time, dtype=np.float64)
+    magnitude = np.abs(np.asarray(accel))
+    entries = np.flatnonzero(magnitude < entry)
+    exits = np.flatnonzero(magnitude > exit)
+
+    intervals = []
+    k = 0
+    while k < len(entries):
+        start = entries[k]
+        # first sample at least min_time after the start, checked the same way as the loop did
+        i = np.searchsorted(time, time[start] + min_time, side='left')
+        while i > start and time[i-1] - time[start] >= min_time:
+            i -= 1
+        while i < len(time) and time[i] - time[start] < min_time:
             i += 1
+        m = np.searchsorted(exits, max(i, start + 1))
+        if m == len(exits):
+            break
+        end = exits[m]
+        intervals.append((start, end))
+        k = np.searchsorted(entries, end, side='right')
+
+    parabolas = np.zeros(len(intervals), dtype=PARABOLA_DTYPE)
+    if intervals:
+        idx = np.array(intervals)
+        parabolas['num'] = np.arange(1, len(intervals) + 1)
+        parabolas['start_index'], parabolas['end_index'] = idx[:,0], idx[:,1]
+        parabolas['start'], parabolas['end'] = time[idx[:,0]], time[idx[:,1]]
+        parabolas['duration'] = parabolas['end'] - parabolas['start']
     return parabolas
 
-def linear_interpolation(x, p0, p1):
-    x0, y0 = p0
-    x1, y1 = p1
-    return y0 + (x - x0) * (y1 - y0) / (x1 - x0)
+class parabola_detector:
+    '''
+    Online version of detect_parabolas(), for acceleration data that arrives in chunks.
+
+    Calling the detector with the next chunk of (time, accel) samples returns the events found in
+    it, as (event, num, time, index) tuples where event is 'start' or 'end' and index counts samples
+    since the first chunk. A 'start' is reported at the entry crossing and an 'end' as soon as the
+    exit rule is met, so a parabola is known while it is still being flown. Only the start of the
+    current parabola is remembered between chunks. Feeding a series in any chunks gives the same
+    parabolas as detect_parabolas() on the whole series.
+    '''
+    def __init__(self, entry=config.MICRO_G_ENTRY_THRESHOLD, exit=config.MICRO_G_EXIT_THRESHOLD,
+            min_time=config.MIN_PARABOLA_TIME):
+        self.entry = entry
+        self.exit = exit
+        self.min_time = min_time
+        self.reset()
+
+    def reset(self):
+        self.num = 0            # number of the last parabola started
+        self.start = None       # start time of the current parabola, None outside of parabolas
+        self.samples = 0        # samples seen so far
+
+    def __call__(self, time, accel):
+        time = np.asarray(time, dtype=np.float64)
+        magnitude = np.abs(np.asarray(accel))
+        entries = np.flatnonzero(magnitude < self.entry)
+        exits = np.flatnonzero(magnitude > self.exit)
+
+        events = []
+        pos = 0
+        while True:
+            if self.start is None:
+                k = np.searchsorted(entries, pos)
+                if k == len(entries):
+                    break
+                i = entries[k]
+                self.num += 1
+                self.start = time[i]
+                events.append(('start', self.num, time[i], self.samples + i))
+            else:
+                k = np.searchsorted(exits, pos)
+                late = np.flatnonzero(time[exits[k:]] - self.start >= self.min_time)
+                if len(late) == 0:
+                    break
+                i = exits[k + late[0]]
+                self.start = None
+                events.append(('end', self.num, time[i], self.samples + i))
+            pos = i + 1
+        self.samples += len(time)
+        return events
+
+def find_parabolas(data):
+    return detect_parabolas(data.time, data.readings)
+
+class channel_window:
+    '''
+    Samples [start, stop) of a channel (flight_data, processed_flight_data or a store channel)
+    without copying them.
+
+    time, readings and accel are read only views into the channel's arrays, so any number of
+    windows can share one dataset. Assigning a column (e.g. window.readings = window.readings - r0)
+    only replaces it for this window; writing into a view in place raises an error instead of
+    changing the shared data.
+    '''
+    columns = ('time', 'readings', 'accel')
+
+    def __init__(self, channel, start, stop):
+        self.num = channel.num
+        self.name = channel.name
+        self.channel = channel
+        self.start = start
+        self.stop = stop
+
+    def __getattr__(self, column):
+        if column not in channel_window.columns or 'channel' not in self.__dict__:
+            raise AttributeError(column)
+        values = np.asarray(getattr(self.channel, column))
+        if len(values) == 0:
+            return values
+        view = values[self.start:self.stop].view()
+        view.flags.writeable = False
+        return view
+
+    def __len__(self):
+        return len(self.time)
 
 class parabola:
-    def __init__(self, num, start, end, data, procedure):
+    '''
+    Data of one parabola: a channel_window per channel, starting window[0] samples before the
+    sample closest to the parabola start and window[1] samples long.
+    '''
+    def __init__(self, num, start, end, data, procedure, window=config.PARABOLA_WINDOW):
         self.num = num
         self.start = start
         self.end = end
         self.name = "Parabola " + str(num)
-        self.data = copy.deepcopy(data)
         self.procedure = procedure
+        self.data = []
       
         print(f"Parsing {self.name}")
-        for cell in self.data:
-            idx = np.searchsorted(cell.time, self.start, side="left")
-            if idx > 0 and (idx == len(cell.time) or math.fabs(self.start - cell.time[idx-1]) < math.fabs(self.start - cell.time[idx])):
-                idx -= 1
+        before, length = window
+        for cell in data:
+            idx = nearest_index(cell.time, self.start)
             # create data subsets of each of the loadcells
-            MIN = idx - 3
-            MAX = MIN + 30
-            cell.time = cell.time[MIN:MAX]
-            cell.readings = cell.readings[MIN:MAX]
-            cell.accel = cell.accel[MIN:MAX]
-
-def get_parabola_sets(data, parab_times):
-    parab_start = parab_times[1]
-    parab_end = parab_times[2]
+            MIN = max(idx - before, 0)
+            MAX = MIN + length
+            self.data.append(channel_window(cell, MIN, MAX))
+
+class parabola_tensor:
+    '''
+    Every parabola resampled onto one grid of times relative to the parabola start.
+
+    readings[p, c, k] and accel[p, c, k] are channel c of parabola p at parabs[p].start + grid[k],
+    linearly interpolated between the samples of the parabola's channel window (NaN outside of
+    it). Comparing parabolas (ensemble averages, fill/control ratios, effective mass) is then a
+    single array operation on matching relative times, e.g.
+
+        ratio = tensor.readings / tensor.readings[tensor.control]
+
+    Args:
+        parabs: List of parabola objects, as returned by get_parabola_sets().
+        grid: Relative times to resample onto. By default every 'step' seconds over the time span
+            that all channel windows with data cover. 'has_data' [parabola, channel] is False for
+            windows that do not span the parabola start, e.g. a parabola outside the load cell data.
+    '''
+    def __init__(self, parabs, grid=None, step=config.PARABOLA_GRID_STEP):
+        self.nums = np.array([p.num for p in parabs])
+        self.starts = np.array([p.start for p in parabs], dtype=np.float64)
+        self.ends = np.array([p.end for p in parabs], dtype=np.float64)
+        self.procedures = [p.procedure for p in parabs]
+        self.channels = [cell.name for cell in parabs[0].data]
+        self.channel_nums = [cell.num for cell in parabs[0].data]
+
+        # windows padded to the same length, [parabola, channel, sample]
+        length = max(max(len(cell) for p in parabs for cell in p.data), 2)
+        time, readings, accel = (np.full((len(parabs), len(self.channels), length), np.nan) for _ in range(3))
+        for i, p in enumerate(parabs):
+            for j, cell in enumerate(p.data):
+                n = len(cell)
+                time[i,j,:n] = cell.time - p.start
+                readings[i,j,:n] = cell.readings
+                accel[i,j,:n] = cell.accel
+
+        # Windows that do not span the parabola start (parabolas before or after the channel's data)
+        # have no data for the parabola, they are left out of the grid and resample to NaN
+        last = np.sum(~np.isnan(time), axis=2)[:,:,None] - 1
+        first_time, last_time = time[:,:,0], np.take_along_axis(time, np.maximum(last, 0), axis=2)[:,:,0]
+        self.has_data = (last[:,:,0] >= 0) & (first_time <= 0) & (last_time >= 0)
+        time[~self.has_data] = np.nan
+        last[~self.has_data] = -1
+
+        if grid is None:
+            if not self.has_data.any():
+                raise ValueError("No parabola has channel data around its start, check the accel offset")
+            lo, hi = np.max(first_time[self.has_data]), np.min(last_time[self.has_data])
+            grid = np.arange(np.ceil(lo / step), np.floor(hi / step) + 1) * step
+        self.grid = np.asarray(grid, dtype=np.float64)
+
+        # index of the sample at or before every grid time, per window
+        below = np.sum(time[:,:,:,None] <= self.grid, axis=2) - 1
+        i0 = np.clip(below, 0, np.maximum(last - 1, 0))
+        t0 = np.take_along_axis(time, i0, axis=2)
+        t1 = np.take_along_axis(time, i0 + 1, axis=2)
+        w = (self.grid - t0) / (t1 - t0)
+        outside = (below < 0) | (self.grid > np.take_along_axis(time, last, axis=2))
+        def resample(values):
+            v0 = np.take_along_axis(values, i0, axis=2)
+            v1 = np.take_along_axis(values, i0 + 1, axis=2)
+            out = v0 + w * (v1 - v0)
+            out[outside] = np.nan
+            return out
+        self.readings = resample(readings)
+        self.accel = resample(accel)
+
+    @property
+    def control(self):
+        '''
+        Index of the control parabola of each parabola's set (the last 'Control' parabola at or
+        before it), for pairing fill parabolas with their control.
+        '''
+        is_control = np.array([p == 'Control' for p in self.procedures])
+        last = np.where(is_control, np.arange(len(is_control)), 0)
+        return np.maximum.accumulate(last)
+
+    def sets(self, procedures=FILL_PROCEDURES):
+        '''
+        Parabola indices grouped by their control, [set][procedure]: one row per control parabola
+        that has test parabolas and one column per procedure in 'procedures' (the first parabola
+        with that procedure after the control, -1 if there is none). Parabolas before the first
+        control belong to no set.
+        '''
+        ctrl = self.control
+        controls = [i for i, p in enumerate(self.procedures) if p == 'Control']
+        grid = np.full((len(controls), len(procedures)), -1)
+        for i, procedure in enumerate(self.procedures):
+            if procedure in procedures and self.procedures[ctrl[i]] == 'Control':
+                cell = (controls.index(ctrl[i]), procedures.index(procedure))
+                if grid[cell] < 0:
+                    grid[cell] = i
+        return grid[(grid >= 0).any(axis=1)]
+
+    def channel_index(self, cells):
+        '''
+        Channel indices of 'cells', e.g. channel_index(utils.get_data_subset(tank_set, parab.data)).
+        '''
+        return [self.channel_nums.index(cell.num) for cell in cells]
+
+def fill_procedures(parab_times, states):
+    '''
+    Procedure of every parabola from the state timeline (a state_interval_index of the states
+    channel): the last fill state set between the end of the previous parabola and the end of
+    this one, or 'Control' if the tanks were not filled in that time.
+    '''
+    procedures = []
+    prev_end = -np.inf
+    for p in parab_times:
+        intervals = states.overlapping(prev_end, p['end'])
+        fills = intervals['state'][(intervals['state'] > 0) & (intervals['start'] > prev_end)]
+        procedures.append(f"Fill {int(fills[-1])}%" if len(fills) else 'Control')
+        prev_end = p['end']
+    return procedures
+
+def get_parabola_sets(data, parab_times, window=config.PARABOLA_WINDOW, states=None):
+    '''
+    parabola objects for 'parab_times'. Parabolas are labeled by their fill state if the state
+    timeline 'states' (state_interval_index) is given, otherwise by their position in the
+    Control, Fill 25%, Fill 50%, Fill 75% sequence.
+    '''
     parab_list = []
-    procedures = ['Control', 'Fill 25%', 'Fill 50%', 'Fill 75%']
-    for i, (t_start, t_end) in enumerate(zip(parab_start, parab_end)):
-        parab_list.append(parabola(i+1, t_start, t_end, data, procedures[i%4]))
+    if states is not None:
+        procedures = fill_procedures(parab_times, states)
+    else:
+        procedures = [(['Control'] + FILL_PROCEDURES)[i%4] for i in range(len(parab_times))]
+    for p, procedure in zip(parab_times, procedures):
+        parab_list.append(parabola(p['num'], p['start'], p['end'], data, procedure, window))
     return parab_list
     
 if __name__ == "__main__":
-    accel = parser.flight_data('z-acceleration', -1, 'acceleration', config.ACCEL_DATA, datacol=12)
-    accel.zero_times(accel.time[0] + config.OFFSET)
+    accel = parser.flight_data('z-acceleration', -1, 'acceleration', config.ACCEL_DATA,
+            timecol=config.ACCEL_TIME_COLUMN, datacol=config.ACCEL_COLUMN)
+    accel.zero_times(accel.time[0] + parser.accel_offset())
 
     p = find_parabolas(accel)
     
-    with open(config.PARABOLAS, 'w+') as f:
-        f.write('parabola, start_time, end_time, duration\r\n')
-        for i in range(len(p[0])):
-            f.write("%d, %.4f, %.4f, %.4f\r\n" % (p[0][i], p[1][i], p[2][i], p[3][i]))
+    write_csv(config.PARABOLAS, ['parabola, start_time, end_time, duration'],
+              [p['num'], p['start'], p['end'], p['duration']], ['%d', '%.4f', '%.4f', '%.4f'], delimiter=', ')
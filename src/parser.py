@@ -2,7 +2,17 @@
 
 import numpy as np
 import analytics_config as config
-import math
+from lazy_csv import lazy_csv
+from flight_store import write_store
+from csv_writer import write_csv
+from timeseries import Timeseries, LinearInterpolation, NearestInterpolation
+from scipy.signal import lfilter
+import offset_estimation
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+import copy
+
+STATE_CODES = {'Idle': 0, 'Reset': -1, 'Fill %25': 25, 'Fill %50': 50, 'Fill %75': 75}
+UNKNOWN_STATE = -99     # code of states missing from STATE_CODES
 
 class flight_data:    
     def __init__(self, name, n, data_type, path, timecol=0, datacol=1):
@@ -10,40 +20,40 @@ class flight_data:
         self.data_type = data_type
         self.name = name
         print(f"Reading in {path}")
-        data = np.genfromtxt(path, unpack=False, delimiter=',', skip_header=1, usecols=(timecol, datacol), dtype=None, encoding=None, names=['Time', 'Data'])
-        self.time = data['Time']
-        self.readings = data['Data']
+        data = lazy_csv(path)
+        time, readings = data.load(timecol, datacol)
+        self.time = np.ascontiguousarray(time, dtype=np.float64)
+        self.readings = np.ascontiguousarray(readings)
 
     def zero_readings(self, d0):
         print(f"Zeroing '{self.name}' readings")
-        self.readings = [d - d0 for d in self.readings]   
+        self.readings = np.asarray(self.readings)
+        self.readings -= d0
 
     def filter_readings(self, cutoff=100000):
         print(f"Filtering '{self.name}' readings")
-        prev_point = self.readings[0]
-        y = self.readings
+        y = self.readings = np.asarray(self.readings)
         t = self.time
-        for i, point in enumerate(self.readings):
-            if (abs(point - prev_point) > cutoff):
-                self.readings[i] = y[i-2] + ((y[i-1]-y[i-2])/(t[i-1]-t[i-2]))*(t[i]-t[i-2]) #linear interpolation
-            prev_point = point
+        # Spikes are rare, so find them all at once and only repair those. Repairs run in order
+        # since a repaired point is used to interpolate the one after it.
+        for i in np.flatnonzero(np.abs(np.diff(y)) > cutoff) + 1:
+            y[i] = y[i-2] + ((y[i-1]-y[i-2])/(t[i-1]-t[i-2]))*(t[i]-t[i-2]) #linear interpolation
 
     def zero_times(self, t0):
         print(f"Zeroing '{self.name}' times")
-        self.time = [t - t0 for t in self.time]
+        self.time = np.asarray(self.time, dtype=np.float64)
+        self.time -= t0
 
     def downsample(self):
         print(f"Downsampling '{self.name}' times")
-        t_prev = -1
-        downsampled_time = []
-        downsampled_readings = []
-        for i, t in enumerate(self.time):
-            if(t - t_prev > 0.59): 
-                downsampled_time.append(t)
-                downsampled_readings.append(self.readings[i])
-                t_prev = t
-        self.time = downsampled_time
-        self.readings = downsampled_readings
+        keep = min_spacing_mask(self.time, 0.59)
+        self.time = self.time[keep]
+        self.readings = np.asarray(self.readings)[keep]
+
+    def remove_duplicate_times(self, keep='first'):
+        self.time, self.readings, removed = remove_duplicate_times(self.time, self.readings, keep)
+        print(f"Removed {removed} duplicate '{self.name}' times (keep '{keep}')")
+        return removed
 
     def summary(self, frmat):
         print(f"======== {self.name} ==========")
@@ -53,140 +63,307 @@ class flight_data:
         print(f"({len(self.time)}, {len(self.readings)}) total readings")
 
     def str_to_num(self):
-        new_states = []
-        for string in self.readings:
-            if string == 'Idle':
-                new_states.append(0)
-            elif string == 'Reset':
-                new_states.append(-1)
-            elif string == 'Fill %25':
-                new_states.append(25)
-            elif string == 'Fill %50':
-                new_states.append(50)
-            elif string == 'Fill %75':
-                new_states.append(75)
-        self.readings = new_states
+        self.readings = state_codes(self.readings)
         
-    def match_accel_data(self, accel_data_time, accel_data):
-        self.accel = []
-        for n, t_data in enumerate(self.time):
-            idx = np.searchsorted(accel_data_time, t_data, side="left")
-            if idx > 0 and (idx == len(accel_data_time) 
-                    or math.fabs(t_data - accel_data_time[idx-1]) < math.fabs(t_data - accel_data_time[idx])):
-                idx -= 1
-            self.accel.append(accel_data[idx])
-            if (n % 1000 == 999 or n == len(self.time) - 1):
-                print(f"'{self.name}' {n+1} of {len(self.time)} accel values found.")
-
-def linear_interpolation(x, p0, p1):
-    x0, y0 = p0
-    x1, y1 = p1
-    return y0 + (x - x0) * (y1 - y0) / (x1 - x0)
+    def match_accel_data(self, accel_data_time, accel_data, mode='nearest'):
+        print(f"Matching '{self.name}' accel values ({mode})")
+        self.accel = align_to(self.time, accel_data_time, accel_data, mode)
+
+def state_codes(states):
+    '''
+    Numeric codes (STATE_CODES) of state strings. States that have no code are reported and get
+    UNKNOWN_STATE, so the codes stay aligned with the state times.
+    '''
+    states = np.asarray(states)
+    names, inverse = np.unique(states, return_inverse=True)
+    unknown = [str(name) for name in names if name not in STATE_CODES]
+    if unknown:
+        print(f"Unknown states {unknown} set to {UNKNOWN_STATE}")
+    return np.array([STATE_CODES.get(name, UNKNOWN_STATE) for name in names], dtype=np.int64)[inverse]
+
+def min_spacing_mask(time, spacing, t_prev=-1):
+    '''
+    Boolean mask of the samples kept when walking 'time' and keeping every sample that is more
+    than 'spacing' after the last kept one (starting from 't_prev'). Times must be non-decreasing.
+    '''
+    t = np.asarray(time, dtype=np.float64)
+    n = len(t)
+    keep = np.zeros(n, dtype=bool)
+    if n == 0:
+        return keep
+
+    # A sample more than 'spacing' after the one before it is always kept, as the last kept
+    # sample is no later than that one, so only the closer samples need the loop below
+    keep[0] = t[0] - t_prev > spacing
+    np.greater(np.diff(t), spacing, out=keep[1:])
+    keep[1:] &= t[:-1] >= t_prev
+    close = np.flatnonzero(~keep[1:]) + 1
+    if len(close) == 0:
+        return keep
+
+    times, kept = t.tolist(), keep.tolist()
+    for i in close.tolist():
+        if kept[i-1]:
+            t_prev = times[i-1]
+        if times[i] - t_prev > spacing:
+            kept[i] = True
+    return np.array(kept, dtype=bool)
+
+def remove_duplicate_times(time, readings, keep='first'):
+    '''
+    Collapse runs of consecutive samples that share a timestamp into one sample.
+
+    Args:
+        time: Array of sample times.
+        readings: Array of readings with samples along the first axis.
+        keep: 'first' or 'last' keeps that sample of each run, 'mean' averages the run.
+
+    Returns:
+        (time, readings, removed) where 'removed' is the number of samples dropped.
+    '''
+    t = np.asarray(time, dtype=np.float64)
+    y = np.asarray(readings)
+    if len(t) == 0:
+        return t, y, 0
+    starts = np.flatnonzero(np.concatenate(([True], t[1:] != t[:-1])))
+    removed = len(t) - len(starts)
+
+    if keep == 'first':
+        return t[starts], y[starts], removed
+    if keep == 'last':
+        return t[starts], y[np.append(starts[1:], len(t)) - 1], removed
+    if keep == 'mean':
+        counts = np.diff(np.append(starts, len(t))).reshape((-1,) + (1,) * (y.ndim - 1))
+        return t[starts], np.add.reduceat(y, starts, axis=0) / counts, removed
+    raise ValueError(f"Unknown duplicate policy '{keep}'")
+
+def valid_window(time):
+    '''
+    Slice covering the longest run of 'time' that is finite and strictly increasing, i.e. the part
+    of a stream that can be searched or interpolated against.
+    '''
+    t = np.asarray(time, dtype=np.float64)
+    if len(t) < 2:
+        return slice(0, len(t))
+    ok = np.isfinite(t[:-1]) & np.isfinite(t[1:]) & (np.diff(t) > 0)
+    edges = np.flatnonzero(np.diff(np.concatenate(([0], ok.view(np.int8), [0]))))
+    if len(edges) == 0:
+        return slice(0, 1)
+    starts, ends = edges[0::2], edges[1::2]
+    longest = np.argmax(ends - starts)
+    return slice(starts[longest], ends[longest] + 1)
+
+def align_to(time, ref_time, ref_values, mode='nearest'):
+    '''
+    Look up 'ref_values' at every time in 'time' in one batched pass. 'ref_time' is restricted to
+    its valid_window() first.
+
+    Args:
+        time: Array of times to look up.
+        ref_time, ref_values: The reference series (e.g. accel time and readings).
+        mode: 'nearest' takes the reading at the closest reference time (ties go to the later
+            sample), 'linear' interpolates between the two surrounding readings. Times outside
+            the reference series get its first/last reading in both modes.
+    '''
+    t = np.asarray(time, dtype=np.float64)
+    window = valid_window(ref_time)
+    ref_t = np.asarray(ref_time, dtype=np.float64)[window]
+    ref_y = np.asarray(ref_values)[window]
+
+    if mode not in ('nearest', 'linear'):
+        raise ValueError(f"Unknown alignment mode '{mode}'")
+    interpolator = LinearInterpolation if mode == 'linear' else NearestInterpolation
+    return Timeseries(ref_t, ref_y, interpolator).get(t)
+
+class exponential_filter:
+    '''
+    Exponential smoothing, y[n] = alpha*x[n] + (1 - alpha)*y[n-1], seeded with the first sample.
+
+    The recursion runs as a single lfilter() call per alpha. The last output of each channel is
+    kept between calls so a stream can be smoothed in chunks and give the same result as
+    smoothing it all at once.
+
+    Args:
+        alpha: Smoothing factor, either a single value or one value per channel.
+    '''
+    def __init__(self, alpha):
+        self.alpha = np.asarray(alpha, dtype=np.float64)
+        self.state = None
+
+    def reset(self):
+        self.state = None
+
+    def __call__(self, data):
+        '''
+        Smooth 'data', either a 1-D array of samples or a 2-D (channel, sample) block.
+        '''
+        x = np.asarray(data, dtype=np.float64)
+        block = np.atleast_2d(x)
+        y = np.empty_like(block)
+        if block.shape[1] == 0:
+            return y.reshape(x.shape)
+
+        alphas = np.broadcast_to(self.alpha, block.shape[:1])
+        if self.state is None:
+            # First sample passes through unchanged
+            y[:, 0] = block[:, 0]
+            prev, start = block[:, 0], 1
+        else:
+            prev, start = self.state, 0
+
+        for alpha in np.unique(alphas):
+            rows = alphas == alpha
+            zi = ((1 - alpha) * prev[rows])[:, None]
+            y[rows, start:], _ = lfilter([alpha], [1, alpha - 1], block[rows, start:], axis=1, zi=zi)
+
+        self.state = y[:, -1].copy()
+        return y.reshape(x.shape)
 
 def exponential_smoothing(data, alpha):
-    filtered_data = [0]*len(data)
-    filtered_data[0] = data[0]
-    for i, x in enumerate(data[1:]):
-        filtered_data[i+1] = alpha * x + (1 - alpha) * filtered_data[i]
-    return filtered_data
-
-def get_data():
-    import parabola_parser
-    import copy
-    
-    # Load in Data
-    accel_data = flight_data('z-acceleration', -1, 'acceleration', config.ACCEL_DATA, datacol=12)
-    state_data = flight_data('States', -1, 'state', config.DATAPATH + 'state.csv')
-    loadcell_data = [
-        flight_data('Merge Top',         0, 'load_cell', config.DATAPATH + 'load_cell_0_readings.csv'),
-        flight_data('Merge Bottom',      1, 'load_cell', config.DATAPATH + 'load_cell_1_readings.csv'),
-        flight_data('Control Top',       2, 'load_cell', config.DATAPATH + 'load_cell_2_readings.csv'),
-        flight_data('Control Bottom',    3, 'load_cell', config.DATAPATH + 'load_cell_3_readings.csv'),
-        flight_data('Highschool Top',    4, 'load_cell', config.DATAPATH + 'load_cell_4_readings.csv'),
-        flight_data('Highschool Bottom', 5, 'load_cell', config.DATAPATH + 'load_cell_5_readings.csv')]
+    return exponential_filter(alpha)(data)
+
+LOADCELLS = [
+    ('Merge Top',         0, 'load_cell_0_readings.csv'),
+    ('Merge Bottom',      1, 'load_cell_1_readings.csv'),
+    ('Control Top',       2, 'load_cell_2_readings.csv'),
+    ('Control Bottom',    3, 'load_cell_3_readings.csv'),
+    ('Highschool Top',    4, 'load_cell_4_readings.csv'),
+    ('Highschool Bottom', 5, 'load_cell_5_readings.csv')]
+
+def load_accel(accel_path=config.ACCEL_DATA):
+    return flight_data('z-acceleration', -1, 'acceleration', accel_path,
+                       timecol=config.ACCEL_TIME_COLUMN, datacol=config.ACCEL_COLUMN)
 
+def flight_offset(cells, accel_data, datapath=config.DATAPATH, accel_path=config.ACCEL_DATA):
+    '''
+    Offset (in seconds) of the acceleration data. It is estimated from the load cells and the accel
+    data (duplicate times removed) and saved to config.OFFSET_FILE for accel_offset(), next to the
+    offset used: config.OFFSET if it is set, otherwise the estimate (see
+    offset_estimation.save_offset()).
+    '''
+    print("Estimating the offset of the acceleration data")
+    offset, significance, estimates = offset_estimation.estimate_offset(cells, accel_data)
+    offset_estimation.print_estimates(offset, significance, estimates)
+    return offset_estimation.save_offset(offset, significance, estimates, config.OFFSET_FILE, datapath, accel_path)
+
+def accel_offset(datapath=config.DATAPATH, accel_path=config.ACCEL_DATA, estimate=True):
+    '''
+    Offset (in seconds) of the acceleration data: config.OFFSET if it is set, otherwise the offset
+    get_data() saved for this flight. Without a saved offset it is estimated (loading the data) and
+    saved, or config.OFFSET_FALLBACK is used when 'estimate' is False.
+    '''
+    if config.OFFSET is not None:
+        return config.OFFSET
+    offset = offset_estimation.read_offset(config.OFFSET_FILE, datapath, accel_path)
+    if offset is not None:
+        return offset
+    if not estimate:
+        print(f"No offset saved in {config.OFFSET_FILE} for {datapath}, using the fallback offset of {config.OFFSET_FALLBACK} s")
+        return config.OFFSET_FALLBACK
+    cells = [flight_data(name, n, 'load_cell', datapath + filename) for name, n, filename in LOADCELLS]
+    accel_data = load_accel(accel_path)
+    accel_data.remove_duplicate_times()
+    return flight_offset(cells, accel_data, datapath, accel_path)
+
+def process_accel(accel_data, cells):
     # Remove duplicate data from accel_data
-    parsed_time = [accel_data.time[0]]
-    parsed_readings = [accel_data.readings[0]]
-    for t, a in zip(accel_data.time[1:], accel_data.readings[1:]):
-        if (t != parsed_time[-1]):
-            parsed_time.append(t)
-            parsed_readings.append(a)
-    accel_data.time = parsed_time
-    accel_data.readings = parsed_readings
+    accel_data.remove_duplicate_times()
+    offset = flight_offset(cells, accel_data, config.DATAPATH, config.ACCEL_DATA)
     accel_data.readings = exponential_smoothing(accel_data.readings, alpha=0.2)
+    accel_data.zero_times(accel_data.time[0] + offset)
+    return accel_data
 
-    # Format data (zero times, filter 
-    t0 = loadcell_data[0].time[0]
-    for cell in loadcell_data:
-        cell.zero_times(t0)
-        cell.filter_readings()
+def process_states(state_data, t0):
     state_data.zero_times(t0)
-    accel_data.zero_times(accel_data.time[0] + config.OFFSET)
     state_data.str_to_num()
+    state_data.downsample()
+    return state_data
 
-    raw_data = copy.deepcopy(loadcell_data)
+def process_cell(cell, t0, accel_time, accel_readings):
+    # Format data (zero times, filter)
+    cell.zero_times(t0)
+    cell.filter_readings()
+    raw = copy.deepcopy(cell)
 
-    # Process Data
-    for cell in loadcell_data:
-        cell.zero_readings(cell.readings[0])
-        cell.downsample()
-    state_data.downsample()
-    processed_data = loadcell_data
-    
-    # Match acceleration data to loadcell data time
-    for cell in processed_data:
-        cell.match_accel_data(accel_data.time[12000:165000], accel_data.readings[12000:165000])
+    # Process data and match acceleration data to loadcell data time
+    cell.zero_readings(cell.readings[0])
+    cell.downsample()
+    cell.match_accel_data(accel_time, accel_readings)
+    return raw, cell
+
+def get_data(workers=1, processes=False):
+    '''
+    Load and process the load cell, state and acceleration data.
+
+    Each stream is loaded and processed as its own job, so with more than one worker the streams
+    run in parallel. Results always come back in the same order regardless of which job finishes
+    first.
+
+    Args:
+        workers: Number of threads (or processes) used to run the jobs.
+        processes: Boolean value, set to true to use a process pool instead of a thread pool. Only
+            worth it when parsing (rather than reading cached data) dominates.
+    '''
+    pool = ProcessPoolExecutor if processes else ThreadPoolExecutor
+    with pool(max_workers=workers) as executor:
+        # Load in Data
+        accel_job = executor.submit(load_accel, config.ACCEL_DATA)
+        state_job = executor.submit(flight_data, 'States', -1, 'state', config.DATAPATH + 'state.csv')
+        cell_jobs = [executor.submit(flight_data, name, n, 'load_cell', config.DATAPATH + filename)
+                for name, n, filename in LOADCELLS]
+
+        # Process data, every stream is zeroed to the start of the first load cell
+        loadcell_data = [job.result() for job in cell_jobs]
+        t0 = loadcell_data[0].time[0]
+        state_job = executor.submit(process_states, state_job.result(), t0)
+        accel_data = executor.submit(process_accel, accel_job.result(), loadcell_data).result()
+        cell_jobs = [executor.submit(process_cell, cell, t0, accel_data.time, accel_data.readings)
+                for cell in loadcell_data]
+
+        raw_data, processed_data = map(list, zip(*[job.result() for job in cell_jobs]))
+        state_data = state_job.result()
 
     return raw_data, accel_data, state_data, processed_data
 
 if __name__ == "__main__":
 
-    raw_data, accel_data, state_data, processed_data = get_data()
-    
-    with open(config.PROCESSED_DATA, 'w+') as f:
-        # logging.info("Writing processed data to file/")
-        print("Writing processed data to file/")
-        f.write("Merge Top, , ,"
-                +"Merge Bottom, , ,"
-                +"Control Top, , ,"
-                +"Control Bottom, , ,"
-                +"Highschool Top, , ,"
-                +"Highschool Bottom, , ,"
-                +"State, \r\n")
-        f.write("Time_Cell0,Cell0,Accel_Cell0,"
-                +"Time_Cell1,Cell1,Accel_Cell1,"
-                +"Time_Cell2,Cell2,Accel_Cell2,"
-                +"Time_Cell3,Cell3,Accel_Cell3,"
-                +"Time_Cell4,Cell4,Accel_Cell4,"
-                +"Time_Cell5,Cell5,Accel_Cell5,"
-                +"Time_State,State\r\n")
-        for i in range(len(processed_data[0].time)):
-            f.write("%.4f,%f,%f,%.4f,%f,%f,%.4f,%f,%f,%.4f,%f,%f,%.4f,%f,%f,%.4f,%f,%f,%.4f,%f\r\n" % (  
-                processed_data[0].time[i], processed_data[0].readings[i],processed_data[0].accel[i],
-                processed_data[1].time[i], processed_data[1].readings[i],processed_data[1].accel[i],
-                processed_data[2].time[i], processed_data[2].readings[i],processed_data[2].accel[i],
-                processed_data[3].time[i], processed_data[3].readings[i],processed_data[3].accel[i],
-                processed_data[4].time[i], processed_data[4].readings[i],processed_data[4].accel[i],
-                processed_data[5].time[i], processed_data[5].readings[i],processed_data[5].accel[i],
-                state_data.time[i], state_data.readings[i]))
-        
-    with open(config.RAW_DATA, 'w+') as f:
-        # logging.info("Writing raw data to file.")
-        print("Writing raw data to file.")
-        f.write("Time_Cell0,Cell0,"
-                +"Time_Cell1,Cell1,"
-                +"Time_Cell2,Cell2,"
-                +"Time_Cell3,Cell3,"
-                +"Time_Cell4,Cell4,"
-                +"Time_Cell5,Cell5,"
-                +"Time_State,State\r\n")
-        for i in range(len(raw_data[0].time)):
-            f.write("%.4f,%f,%.4f,%f,%.4f,%f,%.4f,%f,%.4f,%f,%.4f,%f,%.4f,%f\r\n" % (  
-                raw_data[0].time[i], raw_data[0].readings[i],
-                raw_data[1].time[i], raw_data[1].readings[i],
-                raw_data[2].time[i], raw_data[2].readings[i],
-                raw_data[3].time[i], raw_data[3].readings[i],
-                raw_data[4].time[i], raw_data[4].readings[i],
-                raw_data[5].time[i], raw_data[5].readings[i],
-                state_data.time[i], state_data.readings[i]))
+    raw_data, accel_data, state_data, processed_data = get_data(workers=config.WORKERS)
+
+    # logging.info("Writing processed data to file/")
+    print("Writing processed data to file/")
+    header = ["Merge Top, , ,"
+              +"Merge Bottom, , ,"
+              +"Control Top, , ,"
+              +"Control Bottom, , ,"
+              +"Highschool Top, , ,"
+              +"Highschool Bottom, , ,"
+              +"State, ",
+              "Time_Cell0,Cell0,Accel_Cell0,"
+              +"Time_Cell1,Cell1,Accel_Cell1,"
+              +"Time_Cell2,Cell2,Accel_Cell2,"
+              +"Time_Cell3,Cell3,Accel_Cell3,"
+              +"Time_Cell4,Cell4,Accel_Cell4,"
+              +"Time_Cell5,Cell5,Accel_Cell5,"
+              +"Time_State,State"]
+    columns = [column for cell in processed_data for column in (cell.time, cell.readings, cell.accel)]
+    write_csv(config.PROCESSED_DATA, header, columns + [state_data.time, state_data.readings],
+              ['%.4f', '%f', '%f'] * 6 + ['%.4f', '%f'])
+
+    # logging.info("Writing raw data to file.")
+    print("Writing raw data to file.")
+    header = ["Time_Cell0,Cell0,"
+              +"Time_Cell1,Cell1,"
+              +"Time_Cell2,Cell2,"
+              +"Time_Cell3,Cell3,"
+              +"Time_Cell4,Cell4,"
+              +"Time_Cell5,Cell5,"
+              +"Time_State,State"]
+    columns = [column for cell in raw_data for column in (cell.time, cell.readings)]
+    write_csv(config.RAW_DATA, header, columns + [state_data.time, state_data.readings],
+              ['%.4f', '%f'] * 6 + ['%.4f', '%f'])
+
+    # Binary stores are what plotting_utils.read_in_data() reads, the csv files are kept for 
+    # everything else. Written after the csv files, the stores remember which csv they match.
+    print("Writing processed and raw data stores.")
+    write_store(config.PROCESSED_STORE, processed_data + [state_data], source=config.PROCESSED_DATA)
+    write_store(config.RAW_STORE, raw_data + [state_data], source=config.RAW_DATA)
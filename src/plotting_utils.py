@@ -5,6 +5,8 @@ import numpy as np
 import pandas as pd
 import parabola_parser
 import parser
+from flight_store import open_processed_store, processed_flight_data
+from state_index import state_interval_index
 
 SIZE = 18
 
@@ -33,6 +35,8 @@ def state_color(state):
         return 'y'
     elif state == 75:
         return 'c'
+    else:
+        return 'k'
 
 def basic_formatting(ax, ax2=0):
     ax.tick_params(direction = 'in', size = 8, top = True, labelsize=SIZE-2)
@@ -44,18 +48,16 @@ def basic_formatting(ax, ax2=0):
         ax.patch.set_visible(False)         # hide the 'canvas'
 
 def add_state_settings_bar(ax, states, ypos, bar_size, zero_time=0):
-    time = [t - zero_time for t in states.time]
-    prev_state = states.readings[0]
-    prev_time = time[0]
-    for j, state in enumerate(states.readings):
-        if state != prev_state:
-            C = state_color(prev_state)
-            ax.barh(y=ypos, width=time[j-1]-prev_time, height=bar_size, left=prev_time, color=str(C), zorder=4)
-            prev_state = state
-            prev_time = time[j-1]
+    '''
+    Draw the state timeline as one bar per state interval, all in a single collection. 'states' is
+    the states channel or a state_interval_index of it.
+    '''
+    index = states if isinstance(states, state_interval_index) else state_interval_index.from_channel(states)
+    xranges = np.column_stack((index.start - zero_time, index.end - index.start))
+    ax.broken_barh(xranges, (ypos - bar_size/2, bar_size), facecolors=[state_color(s) for s in index.states], zorder=4)
 
 def add_parabola_times(ax, parabolas, zero_time=0):
-    for start, end in zip(parabolas[1], parabolas[2]):
+    for start, end in zip(parabolas['start'], parabolas['end']):
         ax.axvline(x=start - zero_time, linewidth=1.5, color='k', linestyle='--', zorder=10)
         ax.axvline(x=end - zero_time, linewidth=1.5, color='k', linestyle='--', zorder=10)
 
@@ -130,44 +132,30 @@ def get_parabola_xlim(subset):
     print("Error: Parabola subset not an acceptable value.")
     exit()
 
-class processed_flight_data:
-    def __init__(self, n, name):
-        self.num = n
-        self.name = name
-        self.time = []
-        self.readings = []
-        self.accel = []
+def read_in_data(time_range=None):
+    '''
+    Load the processed data (from the processed data store), acceleration data and parabolas.
 
-def read_in_data():
-    df = pd.read_csv(config.PROCESSED_DATA, header=[0,1])
-    names = [n[0] for n in [col for col in df][::3]]
-    data = [processed_flight_data(i, name) for i, name in enumerate(names)][:-1]
-    df.columns = df.columns.droplevel()
-    for i in range(0,len(df.columns)-2,3):
-        idx = int(i/3)
-        data[idx].time     = df[df.columns[i+0]].tolist()
-        data[idx].readings = df[df.columns[i+1]].tolist()
-        data[idx].accel    = df[df.columns[i+2]].tolist()
-    
-    state_data = processed_flight_data(-1, "States")
-    state_data.time = df['Time_State'].tolist()
-    state_data.readings = df['State'].tolist()
+    Args:
+        time_range: Optional (start, end) tuple, e.g. config.SET1_PARABOLAS. If set only the
+            processed data inside this time range is read. Parabola data is always read for
+            every parabola, but only the samples around each parabola are touched.
+    '''
+    store = open_processed_store(config.PROCESSED_STORE, config.PROCESSED_DATA)
+    channels = store.slice(*time_range) if time_range else store.load()
+    data, state_data = channels[:-1], channels[-1]
     
-    accel_data = parser.flight_data('z-acceleration', -1, 'acceleration', config.ACCEL_DATA, datacol=12)
+    accel_data = parser.flight_data('z-acceleration', -1, 'acceleration', config.ACCEL_DATA,
+            timecol=config.ACCEL_TIME_COLUMN, datacol=config.ACCEL_COLUMN)
     
-    parsed_time = [accel_data.time[0]]
-    parsed_readings = [accel_data.readings[0]]
-    for t, a in zip(accel_data.time[1:], accel_data.readings[1:]):
-        if (t != parsed_time[-1]):
-            parsed_time.append(t)
-            parsed_readings.append(a)
-    accel_data.time = parsed_time
-    accel_data.readings = parsed_readings
+    accel_data.remove_duplicate_times()
     
-    accel_data.zero_times(accel_data.time[0] + config.OFFSET)
+    accel_data.zero_times(accel_data.time[0] + parser.accel_offset())
     accel_data.readings = parser.exponential_smoothing(accel_data.readings, alpha=0.2)
     
     parabola_times = parabola_parser.find_parabolas(accel_data)
-    parabola_data = parabola_parser.get_parabola_sets(data, parabola_times)
+    channels = store.load()
+    states = state_interval_index.from_channel(channels[-1])
+    parabola_data = parabola_parser.get_parabola_sets(channels[:-1], parabola_times, states=states)
 
     return data, state_data, accel_data, parabola_times, parabola_data
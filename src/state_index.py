@@ -0,0 +1,73 @@
+# Filename: state_index.py  SRC: J.Coppens 2020
+
+import numpy as np
+
+class state_interval_index:
+    '''
+    Timeline of a state stream as intervals of constant state.
+
+    Consecutive samples with the same state are merged into one interval (a vectorized run length
+    encoding), which starts at the first sample of the run and ends where the next interval starts
+    (the last interval ends at the last sample). Intervals are kept in 'intervals', a structured
+    array with fields state, start and end, sorted by time, so lookups are binary searches.
+
+    Args:
+        time: Sorted sample times.
+        states: State of every sample. Any comparable values, e.g. the state codes of a processed
+            states channel or the state strings of state.csv.
+    '''
+    def __init__(self, time, states):
+        time = np.asarray(time, dtype=np.float64)
+        states = np.asarray(states)
+        change = np.flatnonzero(states[1:] != states[:-1]) + 1
+        first = np.r_[0, change] if len(states) else change
+        self.intervals = np.zeros(len(first), dtype=[('state', states.dtype), ('start', np.float64),
+                                                     ('end', np.float64)])
+        self.intervals['state'] = states[first]
+        self.intervals['start'] = time[first]
+        self.intervals['end'] = np.r_[time[change], time[-1:]]
+
+    @classmethod
+    def from_channel(cls, channel):
+        return cls(channel.time, channel.readings)
+
+    @property
+    def states(self):
+        return self.intervals['state']
+
+    @property
+    def start(self):
+        return self.intervals['start']
+
+    @property
+    def end(self):
+        return self.intervals['end']
+
+    def __len__(self):
+        return len(self.intervals)
+
+    def interval_at(self, t):
+        '''
+        Index of the interval holding time 't' (scalar or array), -1 outside of the timeline.
+        '''
+        i = np.searchsorted(self.start, t, side='right') - 1
+        if len(self):
+            i = np.where(np.asarray(t) > self.end[-1], -1, i)
+        return i
+
+    def state_at(self, t, default=None):
+        '''
+        State at time 't' (scalar or array), 'default' outside of the timeline.
+        '''
+        i = self.interval_at(t)
+        if np.ndim(i) == 0:
+            return self.states[i] if i >= 0 else default
+        return np.where(i >= 0, self.states[np.maximum(i, 0)], default)
+
+    def overlapping(self, t0, t1):
+        '''
+        Intervals overlapping the time range [t0, t1], as a view into 'intervals'.
+        '''
+        lo = np.searchsorted(self.end, t0, side='left')
+        hi = np.searchsorted(self.start, t1, side='right')
+        return self.intervals[lo:max(lo, hi)]
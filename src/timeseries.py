@@ -0,0 +1,207 @@
+# Filename: timeseries.py  SRC: J.Coppens 2020
+
+import numpy as np
+from typing import Callable
+
+def LinearInterpolation(t1, x1, t2, x2, t):
+    return (x2 - x1)*((t - t1)/(t2 - t1)) + x1
+
+def NearestInterpolation(t1, x1, t2, x2, t):
+    # ties go to the later sample
+    return np.where(np.abs(t - t1) < np.abs(t - t2), x1, x2)
+
+def nearest_index(ts, t):
+    '''
+    Index of the sample of the sorted times 'ts' closest to 't' (scalar or array), ties go to the
+    later sample. Two binary searches, 'ts' is not checked or copied.
+    '''
+    idx = np.searchsorted(ts, t, side='left')
+    left = ts[np.maximum(idx - 1, 0)]
+    right = ts[np.minimum(idx, len(ts) - 1)]
+    use_left = (idx > 0) & ((idx == len(ts)) | (np.abs(t - left) < np.abs(t - right)))
+    return idx - use_left
+
+class column_buffer:
+    '''
+    Array that grows by doubling its capacity, so appending a chunk is amortized O(chunk).
+    'values' starts the buffer off with an existing array, without copying it.
+    '''
+    def __init__(self, dtype=np.float64, values=None):
+        if values is not None:
+            self.buffer = np.ascontiguousarray(values)
+            self.size = len(self.buffer)
+        else:
+            self.buffer = np.empty(1024, dtype=dtype)
+            self.size = 0
+
+    def append(self, values):
+        values = np.asarray(values)
+        if self.size == 0 and values.dtype != self.buffer.dtype:
+            self.buffer = np.empty(len(self.buffer), dtype=values.dtype)
+        if self.size + len(values) > len(self.buffer):
+            grown = np.empty(max(2 * len(self.buffer), self.size + len(values), 1024), dtype=self.buffer.dtype)
+            grown[:self.size] = self.buffer[:self.size]
+            self.buffer = grown
+        self.buffer[self.size:self.size + len(values)] = values
+        self.size += len(values)
+
+    @property
+    def data(self):
+        return self.buffer[:self.size]
+
+class Timeseries:
+    '''
+    Time series backed by sorted, contiguous time and value arrays.
+
+    get(t) finds the samples around t with a binary search and hands them to 'interpolator', a
+    function (t1, x1, t2, x2, t) -> x. For an array of times the interpolator is called once with
+    arrays, so it should only use arithmetic/NumPy operations. LinearInterpolation and
+    NearestInterpolation take a direct NumPy path. Times outside the series get its first/last
+    value.
+
+    min(), max() and mean() aggregate the samples in a time window [t0, t1]. The first such query
+    builds prefix sums and sparse tables of the values (O(n log n) once, dropped again by
+    append()), after which every window costs two binary searches and O(1) table lookups. t0 and
+    t1 can be arrays to answer many windows at once.
+
+    Args:
+        ts: Sample times. Sorted here if they are not sorted already. Repeated times should be
+            removed first (see parser.remove_duplicate_times()).
+        vals: Sample values.
+        interpolator: Interpolation function, LinearInterpolation by default.
+    '''
+    def __init__(self, ts, vals, interpolator: Callable = LinearInterpolation):
+        ts = np.asarray(ts, dtype=np.float64)
+        vals = np.asarray(vals)
+        if len(ts) != len(vals):
+            raise ValueError(f"Got {len(ts)} times but {len(vals)} values")
+        if np.any(ts[1:] < ts[:-1]):
+            order = np.argsort(ts, kind='stable')
+            ts, vals = ts[order], vals[order]
+        self.time = column_buffer(values=ts)
+        self.values = column_buffer(values=vals)
+        self.interpolator = interpolator
+        self.prefix = None
+        self.tables = None
+
+    @classmethod
+    def from_channel(cls, channel, column='readings', interpolator: Callable = LinearInterpolation):
+        '''
+        Series of one column of a flight_data or processed_flight_data channel.
+        '''
+        return cls(channel.time, getattr(channel, column), interpolator)
+
+    @property
+    def ts(self):
+        return self.time.data
+
+    @property
+    def vals(self):
+        return self.values.data
+
+    def __len__(self):
+        return self.time.size
+
+    def append(self, ts, vals):
+        '''
+        Append samples in bulk. They must not be earlier than the last sample.
+        '''
+        ts = np.asarray(ts, dtype=np.float64)
+        if len(ts) != len(vals):
+            raise ValueError(f"Got {len(ts)} times but {len(vals)} values")
+        if len(ts) == 0:
+            return
+        if np.any(ts[1:] < ts[:-1]) or (len(self) and ts[0] < self.ts[-1]):
+            raise ValueError("Appended samples must be sorted and not earlier than the last sample")
+        self.time.append(ts)
+        self.values.append(vals)
+        self.prefix = None
+        self.tables = None
+
+    def index(self, t):
+        '''
+        Index of the sample closest to 't' (scalar or array), ties go to the later sample.
+        '''
+        return nearest_index(self.ts, t)
+
+    def get(self, t):
+        '''
+        Value at time 't', a float or an array of times.
+        '''
+        ts, vals = self.ts, self.vals
+        if len(ts) == 0:
+            raise ValueError("Timeseries is empty")
+        if self.interpolator is LinearInterpolation:
+            return np.interp(t, ts, vals)
+        if self.interpolator is NearestInterpolation:
+            return vals[self.index(t)]
+        if len(ts) == 1:
+            return vals[0] if np.ndim(t) == 0 else np.full(np.shape(t), vals[0])
+
+        t = np.clip(t, ts[0], ts[-1])
+        j = np.clip(np.searchsorted(ts, t, side='right') - 1, 0, len(ts) - 2)
+        return self.interpolator(ts[j], vals[j], ts[j+1], vals[j+1], t)
+
+    def build_aggregates(self):
+        '''
+        Build the prefix sums (for mean()) and the min/max sparse tables, where row k holds the
+        min/max of the 2**k samples starting at each sample.
+        '''
+        vals = self.vals
+        n = len(vals)
+        total = np.int64 if np.issubdtype(vals.dtype, np.integer) else np.float64
+        self.prefix = np.zeros(n + 1, dtype=total)
+        np.cumsum(vals, dtype=total, out=self.prefix[1:])
+
+        self.tables = {}
+        for name, op in (('min', np.minimum), ('max', np.maximum)):
+            table = np.empty((max(n.bit_length(), 1), n), dtype=vals.dtype)
+            table[0] = vals
+            for k in range(1, len(table)):
+                step = 1 << (k - 1)
+                table[k] = table[k-1]
+                op(table[k-1, :n-step], table[k-1, step:], out=table[k, :n-step])
+            self.tables[name] = table
+
+    def window(self, t0, t1):
+        '''
+        Sample index range [lo, hi) of the samples with t0 <= time <= t1.
+        '''
+        return np.searchsorted(self.ts, t0, side='left'), np.searchsorted(self.ts, t1, side='right')
+
+    def aggregate(self, how, t0, t1):
+        '''
+        'min', 'max' or 'mean' of the values in the window [t0, t1] (floats or arrays of window
+        bounds). NaN for windows without samples.
+        '''
+        if self.tables is None:
+            self.build_aggregates()
+        lo, hi = self.window(t0, t1)
+        if len(self) == 0:
+            result = np.full(np.shape(lo), np.nan)
+            return result.item() if result.ndim == 0 else result
+        n = hi - lo
+        empty = n <= 0
+        lo = np.minimum(lo, max(len(self) - 1, 0))
+        with np.errstate(invalid='ignore', divide='ignore'):
+            if how == 'mean':
+                result = (self.prefix[np.maximum(hi, lo)] - self.prefix[lo]) / n
+            elif how in self.tables:
+                k = np.frexp(np.maximum(n, 1))[1] - 1     # floor(log2(n))
+                table = self.tables[how]
+                ends = np.maximum(hi - (1 << k), lo)
+                op = np.minimum if how == 'min' else np.maximum
+                result = op(table[k, lo], table[k, ends]).astype(np.float64)
+            else:
+                raise ValueError(f"Unknown aggregate '{how}'")
+        result = np.where(empty, np.nan, result)
+        return result.item() if result.ndim == 0 else result
+
+    def min(self, t0, t1):
+        return self.aggregate('min', t0, t1)
+
+    def max(self, t0, t1):
+        return self.aggregate('max', t0, t1)
+
+    def mean(self, t0, t1):
+        return self.aggregate('mean', t0, t1)
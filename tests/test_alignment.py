@@ -0,0 +1,61 @@
+import numpy as np
+import pytest
+from alignment import stream, align, common_grid
+
+def brute_force(ts, values, method, tolerance, fill, t):
+    '''
+    Value of one stream at time 't', one sample at a time.
+    '''
+    before = [i for i in range(len(ts)) if ts[i] <= t]
+    after = [i for i in range(len(ts)) if ts[i] >= t]
+    if method == 'previous':
+        i = before[-1] if before else None
+    elif method == 'next':
+        i = after[0] if after else None
+    elif method == 'nearest':
+        i = min(range(len(ts)), key=lambda j: (abs(t - ts[j]), -j))
+    else:
+        if not before or not after or ts[after[0]] - ts[before[-1]] > tolerance:
+            return fill
+        i, j = before[-1], after[0]
+        if i == j:
+            return values[i]
+        return values[i] + (values[j] - values[i]) * (t - ts[i]) / (ts[j] - ts[i])
+    if i is None or abs(t - ts[i]) > tolerance:
+        return fill
+    return values[i]
+
+@pytest.mark.parametrize('method', ['linear', 'nearest', 'previous', 'next'])
+@pytest.mark.parametrize('tolerance', [np.inf, 0.5])
+def test_lookup(method, tolerance):
+    rng = np.random.default_rng(0)
+    # irregular samples with a gap, as with dropped samples
+    ts = np.cumsum(rng.uniform(0.05, 0.6, 200))
+    ts[100:] += 5
+    values = rng.normal(size=(200, 2))
+    grid = np.r_[rng.uniform(ts[0] - 2, ts[-1] + 2, 500), ts[::7]]
+    s = stream('x', ts, values, method=method, tolerance=tolerance)
+    aligned = align([s], grid, chunk=64)
+    for j in range(2):
+        expected = [brute_force(ts, values[:, j], method, tolerance, np.nan, t) for t in grid]
+        np.testing.assert_allclose(aligned['x'][:, j], expected, rtol=1e-12, equal_nan=True)
+
+def test_linear_does_not_bridge_gaps():
+    # 1.2 s is close to the sample at 1 s but lies in the 4 s gap up to the next one
+    s = stream('x', [0.0, 1.0, 5.0, 6.0], [0.0, 10.0, 50.0, 60.0], tolerance=1.5)
+    aligned = align([s], [0.5, 1.0, 1.2, 4.9, 5.0, 5.5])
+    np.testing.assert_allclose(aligned['x'], [5.0, 10.0, np.nan, np.nan, 50.0, 55.0])
+
+def test_integer_stream_keeps_its_type():
+    s = stream('State', [0.0, 1.0, 2.0], np.array([0, 25, 50]), method='previous', tolerance=1.5, fill=-1)
+    aligned = align([s], [-1.0, 0.5, 1.0, 3.0, 4.0])
+    assert aligned['State'].dtype == np.int64
+    np.testing.assert_array_equal(aligned['State'], [-1, 0, 25, 50, -1])
+
+def test_offset_and_grid():
+    a = stream('a', np.arange(0.0, 10.0), np.arange(10.0))
+    b = stream('b', np.arange(0.0, 10.0), np.arange(10.0), offset=2.5)
+    np.testing.assert_allclose(common_grid([a, b], 2.0), [2.5, 4.5, 6.5, 8.5])
+    np.testing.assert_allclose(common_grid([a, b], 2.0, span='union'), np.arange(0.0, 12.0, 2.0))
+    aligned = align([a, b], [3.0, 5.0])
+    np.testing.assert_allclose(aligned['b'], [0.5, 2.5])
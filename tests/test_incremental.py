@@ -0,0 +1,131 @@
+import numpy as np
+import os
+import analytics_config as config
+import flight_store
+import parser
+import incremental
+
+STATES = ['Idle', 'Fill %25', 'Idle', 'Fill %50', 'Idle', 'Fill %75', 'Reset']
+
+def write_flight(folder, rng, n=2000):
+    '''
+    Contents of a run folder and accel file: load cells on slightly irregular clocks with rare
+    spikes, a state.csv file, and accel data with repeated GPS times.
+    '''
+    files = {}
+    for _, i, filename in parser.LOADCELLS:
+        time = 1746.8 + 0.05*i + np.cumsum(rng.choice([0.3, 0.55, 0.6, 0.65], n))
+        readings = np.cumsum(rng.integers(-500, 500, n)) - 1300000
+        readings[rng.integers(1, n, 3)] += 300000
+        files[os.path.join(folder, filename)] = "Time,Reading\n" + "".join(
+            f"{t:.6f},{r}\n" for t, r in zip(time, readings))
+    time = 1747.0 + np.cumsum(rng.choice([0.59, 0.6, 0.61], n))
+    states = np.array(STATES)[np.minimum(np.arange(n) // 150 % 8, 6)]
+    files[os.path.join(folder, 'state.csv')] = "Time,State,Pump 1 Voltage,Pump 2 Voltage\n" + "".join(
+        f"{t:.6f},{s},0,0\n" for t, s in zip(time, states))
+    steps = int(n * 0.6 / 0.1) + 3000
+    time = np.repeat(1.6e5 + 0.1 * np.arange(steps), rng.integers(1, 3, steps))
+    accel = 9.81 + rng.normal(0, 0.5, len(time))
+    accel[np.sin(time / 20) > 0.9] = 0.05
+    files[os.path.join(folder, 'FlightData.csv')] = "GPS Time (s),Ax (m/s^2),Az (m/s^2)\n" + "".join(
+        f"{t:.2f},0.1,{a:.4f}\n" for t, a in zip(time, accel))
+    return {path: text.encode() for path, text in files.items()}
+
+def test_chunked_updates_match_get_data(tmp_path, monkeypatch):
+    rng = np.random.default_rng(0)
+    run, out = str(tmp_path / 'run'), str(tmp_path / 'out')
+    os.makedirs(run)
+    files = write_flight(run, rng)
+    accel_path = os.path.join(run, 'FlightData.csv')
+    monkeypatch.setattr(config, 'DATAPATH', run + '/')
+    monkeypatch.setattr(config, 'ACCEL_DATA', accel_path)
+    monkeypatch.setattr(config, 'CACHEPATH', None)
+    monkeypatch.setattr(config, 'OFFSET', None)
+    monkeypatch.setattr(config, 'OFFSET_FILE', str(tmp_path / 'offsets.json'))
+
+    # get_data() estimates and saves the offset (the random load cells do not follow the accel, so
+    # the fallback), the incremental run picks it up instead of using its own fallback
+    monkeypatch.setattr(config, 'OFFSET_FALLBACK', 30)
+    for path, data in files.items():
+        with open(path, 'wb') as f:
+            f.write(data)
+    raw, accel, states, processed = parser.get_data()
+    for path in files:
+        os.remove(path)
+    monkeypatch.setattr(config, 'OFFSET_FALLBACK', 390)
+
+    # append every file in random pieces, cutting lines in half
+    updates = incremental.incremental_run(run, out, accel_path)
+    cuts = {path: np.r_[np.sort(rng.integers(0, len(data), 30)), len(data)] for path, data in files.items()}
+    for k in range(31):
+        for path, data in files.items():
+            with open(path, 'ab') as f:
+                f.write(data[cuts[path][k-1] if k else 0:cuts[path][k]])
+        updates.update()
+        updates.write()
+
+    assert updates.accel.offset == 30
+    np.testing.assert_array_equal(updates.accel.time.data, accel.time)
+    np.testing.assert_array_equal(updates.accel.readings.data, accel.readings)
+    for stream, cell, raw_cell in zip(updates.cells, processed, raw):
+        np.testing.assert_array_equal(stream.time.data, cell.time)
+        np.testing.assert_array_equal(stream.readings.data, cell.readings)
+        np.testing.assert_array_equal(stream.accel.data, cell.accel)
+        np.testing.assert_array_equal(stream.raw_time.data, raw_cell.time)
+        np.testing.assert_array_equal(stream.raw_readings.data, raw_cell.readings)
+    np.testing.assert_array_equal(updates.states.time.data, states.time)
+    np.testing.assert_array_equal(updates.states.readings.data, states.readings)
+    store = flight_store.flight_store(os.path.join(out, 'processed_data')).load()
+    for stored, cell in zip(store, processed + [states]):
+        np.testing.assert_array_equal(stored.time, cell.time)
+        np.testing.assert_array_equal(stored.readings, cell.readings)
+        np.testing.assert_array_equal(getattr(stored, 'accel', []), getattr(cell, 'accel', []))
+    store = flight_store.flight_store(os.path.join(out, 'raw_data')).load()
+    for stored, cell in zip(store, raw + [states]):
+        np.testing.assert_array_equal(stored.time, cell.time)
+        np.testing.assert_array_equal(stored.readings, cell.readings)
+
+def test_update_work_is_bounded(tmp_path, monkeypatch):
+    '''
+    Accel lookups and store writes per update depend on the new rows, not on the flight length,
+    while the accel data covers the load cell data.
+    '''
+    rng = np.random.default_rng(1)
+    run, out = str(tmp_path / 'run'), str(tmp_path / 'out')
+    os.makedirs(run)
+    files = write_flight(run, rng, n=4000)
+    monkeypatch.setattr(config, 'OFFSET', 5.0)
+
+    lookups, written, rewrites = [], [], []
+    align_to, append_rows, write_store = parser.align_to, flight_store.append_rows, flight_store.write_store
+    def counting_align_to(time, ref_time, ref_values, mode='nearest'):
+        lookups[-1] += len(time) + len(ref_time)
+        return align_to(time, ref_time, ref_values, mode)
+    def counting_append_rows(path, values, start):
+        written[-1] += len(values) - start
+        return append_rows(path, values, start)
+    def counting_write_store(path, channels, source=None):
+        rewrites.append(path)
+        return write_store(path, channels, source)
+    monkeypatch.setattr(parser, 'align_to', counting_align_to)
+    monkeypatch.setattr(flight_store, 'append_rows', counting_append_rows)
+    monkeypatch.setattr(flight_store, 'write_store', counting_write_store)
+
+    # equal slices of every file per update
+    updates = incremental.incremental_run(run, out, os.path.join(run, 'FlightData.csv'))
+    lines = {path: data.splitlines(keepends=True) for path, data in files.items()}
+    chunks = 40
+    for k in range(chunks):
+        lookups.append(0)
+        written.append(0)
+        for path, rows in lines.items():
+            lo, hi = len(rows) * k // chunks, len(rows) * (k + 1) // chunks
+            with open(path, 'ab') as f:
+                f.write(b''.join(rows[lo:hi]))
+        updates.update()
+        updates.write()
+
+    # both stores are written in full once, then only appended to
+    assert len(rewrites) == 2
+    assert max(lookups[-10:]) < 2 * max(lookups[1:11])
+    assert max(written[-10:]) < 2 * max(written[1:11])
@@ -0,0 +1,92 @@
+import json
+import numpy as np
+import pytest
+import analytics_config as config
+import offset_estimation
+import parser
+
+def flight(rng, offset, duration=1800, noise=2e4, starts=(0,) * 6):
+    '''
+    Accel with micro-g parabolas at irregular times, and six load cells that follow it 'offset'
+    seconds later on their own irregular clocks starting at 'starts', with noise and drift.
+    '''
+    accel_time = np.arange(0, duration + 600, 0.05)
+    accel = np.full(len(accel_time), 9.8)
+    for start in np.sort(rng.uniform(100, duration, 10)):
+        accel[(accel_time > start - 15) & (accel_time < start)] = 17
+        accel[(accel_time > start) & (accel_time < start + 20)] = 0.1
+    accel += rng.normal(0, 0.3, len(accel))
+    cell_times, cell_readings = [], []
+    for start in starts:
+        t = np.sort(rng.uniform(start, duration, int((duration - start) / 0.3)))
+        drift = np.cumsum(rng.normal(0, 50, len(t)))
+        cell_times.append(t)
+        cell_readings.append(np.interp(t + offset, accel_time, accel) * rng.uniform(500, 5000)
+                             + rng.normal(0, noise, len(t)) + drift)
+    return cell_times, cell_readings, accel_time + 1.6e9, accel
+
+@pytest.mark.parametrize('offset', [390.37, 12.5, -40.0])
+def test_recovers_known_offset(offset):
+    rng = np.random.default_rng(0)
+    estimate, significance, estimates = offset_estimation.estimate_offsets(*flight(rng, offset))
+    assert abs(estimate - offset) < 0.1
+    assert significance > config.OFFSET_MIN_SIGNIFICANCE
+    assert np.all(np.abs(estimates['offset'] - offset) < 0.2)
+    assert np.all(estimates['correlation'] > 0)
+
+def test_cells_starting_late():
+    rng = np.random.default_rng(2)
+    cell_times, cell_readings, accel_time, accel = flight(rng, 100.0, starts=(31.3, 45.0, 40.0, 60.2, 33.0, 90.0))
+    estimate, significance, estimates = offset_estimation.estimate_offsets(cell_times, cell_readings, accel_time, accel)
+    assert abs(estimate - 100.0) < 0.1
+    assert np.all(np.abs(estimates['offset'] - 100.0) < 0.2)
+
+    # flight_data objects are zeroed to the first load cell, as in parser.get_data()
+    cells = []
+    for i, (t, y) in enumerate(zip(cell_times, cell_readings)):
+        cell = parser.flight_data.__new__(parser.flight_data)
+        cell.name, cell.time, cell.readings = f"Cell {i}", t + 1746.8, y / 10   # below the spike filter cutoff
+        cells.append(cell)
+    accel_data = parser.flight_data.__new__(parser.flight_data)
+    accel_data.time, accel_data.readings = accel_time, accel
+    estimate, _, _ = offset_estimation.estimate_offset(cells, accel_data)
+    assert abs(estimate - (100.0 + cell_times[0][0])) < 0.1
+
+def test_unrelated_data_is_not_significant():
+    rng = np.random.default_rng(1)
+    for _ in range(3):
+        cell_times, cell_readings, accel_time, accel = flight(rng, 100.0)
+        cell_readings = [np.cumsum(rng.normal(0, 100, len(y))) + rng.normal(0, 1e4, len(y)) for y in cell_readings]
+        _, significance, _ = offset_estimation.estimate_offsets(cell_times, cell_readings, accel_time, accel)
+        assert significance < config.OFFSET_MIN_SIGNIFICANCE
+
+def test_saved_offset(tmp_path, monkeypatch):
+    path = str(tmp_path / 'offsets.json')
+    datapath, accel_path = str(tmp_path / 'run') + '/', str(tmp_path / 'FlightData.csv')
+    estimates = np.zeros(1, dtype=offset_estimation.OFFSET_DTYPE)
+    offset_estimation.write_offset(11.5, 20.0, estimates, 11.5, path, datapath, accel_path)
+    assert offset_estimation.read_offset(path, datapath, accel_path) == 11.5
+    assert offset_estimation.read_offset(path, str(tmp_path / 'other') + '/', accel_path) is None
+    assert offset_estimation.read_offset(str(tmp_path / 'missing.json'), datapath, accel_path) is None
+
+    monkeypatch.setattr(config, 'OFFSET_FILE', path)
+    monkeypatch.setattr(config, 'OFFSET', None)
+    assert parser.accel_offset(datapath, accel_path, estimate=False) == 11.5
+    assert parser.accel_offset(str(tmp_path / 'other') + '/', accel_path, estimate=False) == config.OFFSET_FALLBACK
+    monkeypatch.setattr(config, 'OFFSET', 3.0)
+    assert parser.accel_offset(datapath, accel_path) == 3.0
+
+def test_calibrated_offset_is_kept(tmp_path, monkeypatch, capsys):
+    path = str(tmp_path / 'offsets.json')
+    estimates = np.zeros(1, dtype=offset_estimation.OFFSET_DTYPE)
+    monkeypatch.setattr(config, 'OFFSET', 390)
+    assert offset_estimation.save_offset(390.4, 20.0, estimates, path) == 390
+    assert 'WARNING' not in capsys.readouterr().out
+    assert offset_estimation.save_offset(11.5, 20.0, estimates, path) == 390
+    assert 'WARNING' in capsys.readouterr().out
+    saved = json.load(open(path))
+    assert (saved['offset'], saved['calibrated'], saved['estimate']) == (390, 390, 11.5)
+
+    monkeypatch.setattr(config, 'OFFSET', None)
+    assert offset_estimation.save_offset(11.5, 20.0, estimates, path) == 11.5
+    assert offset_estimation.save_offset(11.5, 2.0, estimates, path) == config.OFFSET_FALLBACK
@@ -0,0 +1,35 @@
+import numpy as np
+from parabola_analytics import segment_stats
+
+def brute_force_stats(time, readings, start, end, band):
+    inside = (time >= start) & (time <= end)
+    t, y = time[inside], readings[inside]
+    if len(y) == 0:
+        return {'samples': 0, 'mean': np.nan, 'slope': np.nan, 'min': np.nan, 'max': np.nan, 'settle_time': np.nan}
+    unsettled = np.flatnonzero(np.abs(y - y[-1]) > band * (y.max() - y.min()))
+    settled = unsettled[-1] + 1 if len(unsettled) else 0
+    return {
+        'samples': len(y),
+        'mean': y.mean(),
+        'slope': np.polyfit(t, y, 1)[0] if len(y) > 1 else np.nan,
+        'min': y.min(),
+        'max': y.max(),
+        'settle_time': t[settled] - start,
+    }
+
+def test_segment_stats():
+    rng = np.random.default_rng(0)
+    time = 1000 + np.cumsum(rng.uniform(0.3, 0.9, 3000))
+    readings = np.cumsum(rng.normal(0, 10, 3000)) + 5e5
+    # sorted, non overlapping segments: empty ones, single samples and one running to the end
+    bounds = np.sort(rng.uniform(time[0] - 20, time[-1], 60))
+    starts, ends = bounds[::2], bounds[1::2]
+    starts = np.r_[time[0] - 30, starts, time[-1] - 0.1]
+    ends = np.r_[time[0] - 25, ends, time[-1] + 5]
+    starts[5], ends[5] = time[np.searchsorted(time, starts[5])], time[np.searchsorted(time, starts[5])]
+
+    stats = segment_stats(time, readings, starts, ends, band=0.05)
+    for i, (start, end) in enumerate(zip(starts, ends)):
+        expected = brute_force_stats(time, readings, start, end, 0.05)
+        for key, value in expected.items():
+            np.testing.assert_allclose(stats[key][i], value, rtol=1e-7, equal_nan=True, err_msg=f"{key} of segment {i}")
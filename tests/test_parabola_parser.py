@@ -0,0 +1,104 @@
+import numpy as np
+import pytest
+from flight_store import processed_flight_data
+from parabola_parser import detect_parabolas, parabola_detector, channel_window, parabola, parabola_tensor
+
+def brute_force_parabolas(time, accel, entry=0.2, exit=0.5, min_time=10):
+    parabolas, start = [], None
+    for i in range(len(time)):
+        if start is None and abs(accel[i]) < entry:
+            start = i
+        elif start is not None and abs(accel[i]) > exit and time[i] - time[start] >= min_time:
+            parabolas.append((start, i))
+            start = None
+    return parabolas
+
+def flight(seed, n=20000):
+    '''
+    Noisy 1 g flight with micro-g windows of random length, some shorter than min_time.
+    '''
+    rng = np.random.default_rng(seed)
+    time = np.cumsum(rng.uniform(0.05, 0.15, n))
+    accel = 9.81 + rng.normal(0, 0.5, n)
+    for start in rng.uniform(0, time[-1], 15):
+        accel[(time > start) & (time < start + rng.uniform(2, 25))] = rng.normal(0, 0.3)
+    accel += rng.normal(0, 0.15, n) * (np.abs(accel) < 1)
+    return time, accel
+
+def test_detect_parabolas():
+    for seed in range(5):
+        time, accel = flight(seed)
+        parabolas = detect_parabolas(time, accel, entry=0.2, exit=0.5, min_time=10)
+        expected = brute_force_parabolas(time, accel)
+        assert list(zip(parabolas['start_index'], parabolas['end_index'])) == expected
+        np.testing.assert_array_equal(parabolas['num'], np.arange(1, len(expected) + 1))
+        np.testing.assert_array_equal(parabolas['duration'], parabolas['end'] - parabolas['start'])
+
+def test_detector_in_chunks():
+    rng = np.random.default_rng(0)
+    for seed in range(5):
+        time, accel = flight(seed)
+        parabolas = detect_parabolas(time, accel, entry=0.2, exit=0.5, min_time=10)
+        detector = parabola_detector(entry=0.2, exit=0.5, min_time=10)
+        bounds = np.r_[0, np.sort(rng.integers(0, len(time), 40)), len(time)]
+        events = [e for lo, hi in zip(bounds[:-1], bounds[1:]) for e in detector(time[lo:hi], accel[lo:hi])]
+        starts = [(num, i) for event, num, t, i in events if event == 'start']
+        ends = [(num, i) for event, num, t, i in events if event == 'end']
+        # a parabola still running at the end of the data has only started
+        assert len(starts) - len(ends) in (0, 1)
+        assert [i for _, i in starts[:len(ends)]] == list(parabolas['start_index'])
+        assert [i for _, i in ends] == list(parabolas['end_index'])
+        assert [num for num, _ in ends] == list(parabolas['num'])
+
+def channel(n, time, readings):
+    cell = processed_flight_data(n, f"Cell {n}")
+    cell.time, cell.readings, cell.accel = time, readings, np.zeros(len(time))
+    return cell
+
+def test_channel_window():
+    cell = channel(0, np.arange(10.0), np.arange(10.0) * 2)
+    window = channel_window(cell, 2, 5)
+    np.testing.assert_array_equal(window.readings, [4.0, 6.0, 8.0])
+    assert np.shares_memory(window.readings, cell.readings)
+    assert len(window) == 3 and window.name == 'Cell 0'
+    with pytest.raises(ValueError):
+        window.readings[0] = 0
+    window.readings = window.readings - window.readings[0]
+    np.testing.assert_array_equal(window.readings, [0.0, 2.0, 4.0])
+    np.testing.assert_array_equal(cell.readings, np.arange(10.0) * 2)
+    np.testing.assert_array_equal(channel_window(cell, 2, 5).readings, [4.0, 6.0, 8.0])
+    with pytest.raises(AttributeError):
+        window.other
+
+def test_parabola_windows():
+    rng = np.random.default_rng(0)
+    data = [channel(n, np.cumsum(rng.uniform(0.3, 0.9, 500)), rng.normal(size=500)) for n in range(3)]
+    for start in [-5.0, 0.0, 40.3, 100.0, 1000.0]:
+        p = parabola(1, start, start + 20, data, 'Control', window=(3, 30))
+        for cell, window in zip(data, p.data):
+            nearest = np.argmin(np.abs(cell.time - start))
+            lo = max(nearest - 3, 0)
+            np.testing.assert_array_equal(window.time, cell.time[lo:lo + 30])
+            np.testing.assert_array_equal(window.readings, cell.readings[lo:lo + 30])
+
+def test_tensor_with_parabola_outside_the_data():
+    rng = np.random.default_rng(1)
+    data = []
+    for n in range(2):
+        time = np.cumsum(rng.uniform(0.55, 0.65, 200))
+        cell = channel(n, time, np.sin(time))
+        cell.accel = np.cos(time)
+        data.append(cell)
+    end = data[0].time[-1]
+    # parabolas before, inside, after and running past the end of the load cell data
+    starts = [-50.0, 20.0, 50.0, end + 100, end - 2]
+    parabs = [parabola(i + 1, start, start + 20, data, 'Control') for i, start in enumerate(starts)]
+    tensor = parabola_tensor(parabs)
+    np.testing.assert_array_equal(tensor.has_data, [[False] * 2, [True] * 2, [True] * 2, [False] * 2, [True] * 2])
+    assert len(tensor.grid) > 1 and tensor.grid[0] <= 0 <= tensor.grid[-1]
+    assert np.isnan(tensor.readings[[0, 3]]).all()
+    np.testing.assert_allclose(tensor.readings[1, 0], np.sin(tensor.grid + 20.0), atol=0.05)
+    assert not np.isnan(tensor.readings[1:3]).any()
+
+    with pytest.raises(ValueError):
+        parabola_tensor([parabs[0], parabs[3]])
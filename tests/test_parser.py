@@ -0,0 +1,26 @@
+import numpy as np
+import pytest
+from parser import min_spacing_mask
+
+def brute_force(ts, spacing, t_prev):
+    keep = np.zeros(len(ts), dtype=bool)
+    for i, t in enumerate(ts):
+        if t - t_prev > spacing:
+            keep[i] = True
+            t_prev = t
+    return keep
+
+@pytest.mark.parametrize('step', [0.05, 0.3, 0.6, 1.0])
+def test_min_spacing_mask(step):
+    rng = np.random.default_rng(0)
+    for n in [0, 1, 2, 7, 2000]:
+        ts = 1000 + np.cumsum(rng.uniform(0.5, 1.5, n) * step)
+        ts[n//3:n//3 + 3] = ts[n//3:n//3 + 1]   # repeated times
+        for t_prev in [-1, 999.5] + list(ts[n//2:n//2 + 1]):
+            assert np.array_equal(min_spacing_mask(ts, 0.59, t_prev), brute_force(ts, 0.59, t_prev))
+
+def test_min_spacing_mask_regular():
+    # Exact 0.6 s steps keep every sample, the case that skips the loop
+    ts = 0.6 * np.arange(1000)
+    assert min_spacing_mask(ts, 0.59).all()
+    assert np.array_equal(min_spacing_mask(ts, 0.6), brute_force(ts, 0.6, -1))
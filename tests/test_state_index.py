@@ -0,0 +1,51 @@
+import numpy as np
+from state_index import state_interval_index
+from parabola_parser import PARABOLA_DTYPE, fill_procedures
+
+def brute_force_state(time, states, t, default):
+    if t < time[0] or t > time[-1]:
+        return default
+    return states[np.flatnonzero(time <= t)[-1]]
+
+def test_intervals():
+    index = state_interval_index([0.0, 1.0, 2.0, 3.0, 4.0, 5.0], [0, 0, 25, 25, 0, -1])
+    np.testing.assert_array_equal(index.states, [0, 25, 0, -1])
+    np.testing.assert_array_equal(index.start, [0.0, 2.0, 4.0, 5.0])
+    np.testing.assert_array_equal(index.end, [2.0, 4.0, 5.0, 5.0])
+    assert len(state_interval_index([], np.array([], dtype=np.int64))) == 0
+
+def test_lookups():
+    rng = np.random.default_rng(0)
+    time = np.cumsum(rng.uniform(0.1, 1.0, 400))
+    states = rng.choice([0, 25, 50, 75, -1], 400, p=[0.7, 0.1, 0.1, 0.05, 0.05])
+    states = np.repeat(states[::4], 4)
+    index = state_interval_index(time, states)
+    t = np.r_[rng.uniform(time[0] - 10, time[-1] + 10, 1000), time]
+    expected = [brute_force_state(time, states, x, -99) for x in t]
+    np.testing.assert_array_equal(index.state_at(t, default=-99), expected)
+    assert index.state_at(t[0], default=-99) == expected[0]
+    assert index.state_at(time[0] - 1) is None
+
+    for t0, t1 in zip(t[:200], t[:200] + rng.uniform(0, 30, 200)):
+        overlap = index.overlapping(t0, t1)
+        expected = [i for i in index.intervals if i['end'] >= t0 and i['start'] <= t1]
+        np.testing.assert_array_equal(overlap, np.array(expected, dtype=index.intervals.dtype))
+
+def test_string_states():
+    index = state_interval_index([0.0, 1.0, 2.0], np.array(['Idle', 'Fill %25', 'Fill %25']))
+    assert index.state_at(1.5) == 'Fill %25'
+    assert list(index.states) == ['Idle', 'Fill %25']
+
+def test_fill_procedures():
+    parabolas = np.zeros(5, dtype=PARABOLA_DTYPE)
+    parabolas['start'] = [10, 30, 50, 70, 90]
+    parabolas['end'] = [20, 40, 60, 80, 100]
+    # fills before parabolas 2 to 4, parabola 4 only has a reset and parabola 5 sees two fills
+    time = [0, 22, 25, 42, 45, 62, 65, 82, 84, 86, 88]
+    states = [0, 25, 0, 50, 0, 75, 0, -1, 25, 50, 0]
+    procedures = fill_procedures(parabolas, state_interval_index(time, np.array(states, dtype=np.int64)))
+    assert procedures == ['Control', 'Fill 25%', 'Fill 50%', 'Fill 75%', 'Fill 50%']
+
+    # states read back from a csv file are floats
+    procedures = fill_procedures(parabolas, state_interval_index(time, np.array(states, dtype=np.float64)))
+    assert procedures[1:4] == ['Fill 25%', 'Fill 50%', 'Fill 75%']
@@ -0,0 +1,43 @@
+import numpy as np
+import pytest
+from timeseries import Timeseries, NearestInterpolation
+
+def brute_force(ts, vals, how, t0, t1):
+    inside = vals[(ts >= t0) & (ts <= t1)]
+    if len(inside) == 0:
+        return np.nan
+    return {'min': np.min, 'max': np.max, 'mean': np.mean}[how](inside)
+
+@pytest.mark.parametrize('how', ['min', 'max', 'mean'])
+@pytest.mark.parametrize('dtype', [np.float64, np.int64])
+def test_window_aggregates(how, dtype):
+    rng = np.random.default_rng(0)
+    for n in [0, 1, 2, 7, 300]:
+        ts = np.cumsum(rng.uniform(0.1, 1.0, n))
+        vals = rng.normal(0, 100, n).astype(dtype)
+        series = Timeseries(ts, vals)
+        t0 = rng.uniform(-5, n + 5, 200)
+        t1 = t0 + rng.uniform(-1, n / 2 + 1, 200)
+        # window bounds exactly on sample times are inside the window
+        if n:
+            t0[:20], t1[:20] = ts[rng.integers(0, n, 20)], ts[rng.integers(0, n, 20)]
+        expected = [brute_force(ts, vals, how, a, b) for a, b in zip(t0, t1)]
+        np.testing.assert_allclose(series.aggregate(how, t0, t1), expected, rtol=1e-12, equal_nan=True)
+        for a, b, e in zip(t0[:10], t1[:10], expected):
+            np.testing.assert_allclose(series.aggregate(how, a, b), e, rtol=1e-12, equal_nan=True)
+
+def test_aggregates_rebuilt_after_append():
+    rng = np.random.default_rng(1)
+    ts, vals = np.arange(50.0), rng.normal(size=50)
+    series = Timeseries(ts[:20], vals[:20])
+    assert series.max(0, 100) == vals[:20].max()
+    series.append(ts[20:], vals[20:])
+    assert series.max(0, 100) == vals.max()
+    assert series.min(10, 30) == vals[10:31].min()
+    np.testing.assert_allclose(series.mean(10, 30), vals[10:31].mean())
+
+def test_get():
+    series = Timeseries([3.0, 1.0, 2.0], [30.0, 10.0, 20.0])
+    np.testing.assert_allclose(series.get([0.0, 1.5, 2.5, 9.0]), [10.0, 15.0, 25.0, 30.0])
+    nearest = Timeseries([1.0, 2.0, 3.0], [10.0, 20.0, 30.0], NearestInterpolation)
+    np.testing.assert_array_equal(nearest.get([1.2, 1.5, 2.9]), [10.0, 20.0, 30.0])
@@ -203,15 +203,9 @@ if __name__ == "__main__":
         if mouse_clicked:
             lastHSV = hsv_frame[mouse_y, mouse_x]
 
-        for i in range(slice_count):
-            boundsmin, boundsmax = tank1.getBounds(hsv_frame, slice_i=i, slice_count=slice_count)
-            cv2.rectangle(to_display, boundsmin, boundsmax, (255, 255, 255))
-            
-            boundsmin, boundsmax = tank2.getBounds(hsv_frame, slice_i=i, slice_count=slice_count)
-            cv2.rectangle(to_display, boundsmin, boundsmax, (255, 255, 255))
-
-            boundsmin, boundsmax = tank3.getBounds(hsv_frame, slice_i=i, slice_count=slice_count)
-            cv2.rectangle(to_display, boundsmin, boundsmax, (255, 255, 255))
+        for tank_bounds in CalculateBounds(hsv_frame, [tank1, tank2, tank3], slice_count):
+            for boundsmin, boundsmax in tank_bounds:
+                cv2.rectangle(to_display, boundsmin, boundsmax, (255, 255, 255))
 
         # Handle different ui modes
         if ui_mode == UI_TANK1_BOUNDS:
@@ -5,6 +5,30 @@ import pandas as pd
 import builtins
 import os
 import sys
+from os.path import abspath, dirname, join
+
+sys.path.append(abspath(join(dirname(__file__), '../src')))
+from csv_writer import csv_writer, write_csv
+
+# frames kept in memory before their rows are written out by OutputRaw
+CHUNK_FRAMES = 256
+
+def ReadSegment(video, start_frame: int, end_frame: int):
+    # Yields (frame_i, raw_frame) for frames start_frame to end_frame - 1. Seeks once and then decodes
+    # forward, since seeking before every frame can make the decoder start over from the previous
+    # keyframe each time. The decoder position is checked before every read and corrected if it is off.
+    if int(video.get(cv2.CAP_PROP_POS_FRAMES)) != start_frame:
+        video.set(cv2.CAP_PROP_POS_FRAMES, start_frame)
+    for frame_i in range(start_frame, end_frame):
+        position = int(video.get(cv2.CAP_PROP_POS_FRAMES))
+        if position != frame_i:
+            print(f"\rDecoder at frame {position} instead of {frame_i}, seeking")
+            video.set(cv2.CAP_PROP_POS_FRAMES, frame_i)
+        ok, raw_frame = video.read()
+        if not ok:
+            print(f"\rCould not read frame {frame_i}, ending segment at it")
+            return
+        yield frame_i, raw_frame
 
 def OutputRaw():
     video = cv2.VideoCapture('../data/ExperimentVideo.mp4')
@@ -36,18 +60,22 @@ def OutputRaw():
                 "Tank 3 Slice " + str(slice_i + 1) + " Max",
             ]
 
-        raw_data_frame = pd.DataFrame([], columns=columns)
-        for frame_i in range(start_frame, end_frame):
-            # Get frame
-            print("\r" + str(round(100*((frame_i - start_frame)/(end_frame - start_frame - 1)), 2) ) + "%: " + str(frame_i), end="")
-            video.set(cv2.CAP_PROP_POS_FRAMES, frame_i)
-            _, raw_frame = video.read()
-
-            row = CalculateRow(raw_frame, frame_i, start_frame, fps, slice_count, L, SCALE_PERCENT, tank1, tank2, tank3)
-            raw_data_frame = raw_data_frame.append(pd.DataFrame([row], columns=columns), ignore_index=True)
+        # Rows go into a preallocated block that is written out (and flushed) every CHUNK_FRAMES frames
+        path = "../out/video/" + str(start_frame) + "to" + str(end_frame) + "_slice" + str(slice_count) + "_raw.csv"
+        block = np.empty((CHUNK_FRAMES, len(columns)), np.float64)
+        rows = 0
+        with csv_writer(path, [",".join(columns)], ["%d"] + ["%s"] * (len(columns) - 1), newline="\n") as writer:
+            for frame_i, raw_frame in ReadSegment(video, start_frame, end_frame):
+                print("\r" + str(round(100*((frame_i - start_frame)/(end_frame - start_frame - 1)), 2) ) + "%: " + str(frame_i), end="")
 
-        raw_data_frame.to_csv("../out/video/" + str(start_frame) + "to" + str(end_frame) + "_slice" + str(slice_count) + "_raw.csv", index=False)
-        print(f"\rWriting raw data {start_frame}to{end_frame}_slice{slice_count}_raw.csv")
+                block[rows] = CalculateRow(raw_frame, frame_i, start_frame, fps, slice_count, L, SCALE_PERCENT, tank1, tank2, tank3)
+                rows += 1
+                if rows == CHUNK_FRAMES:
+                    writer.write(list(block.T))
+                    writer.flush()
+                    rows = 0
+            writer.write(list(block[:rows].T))
+        print(f"\rWrote raw data {start_frame}to{end_frame}_slice{slice_count}_raw.csv")
 
 def OutputFiltered():
     for file in os.listdir("../out/video/"):
@@ -74,7 +102,8 @@ def OutputFiltered():
                     print(f"\rDone filtering {column}            ")
 
             new_file = "../out/video/" + file.replace("_raw.csv", "_filtered.csv")
-            filtered_data_frame.to_csv(new_file, index=False)
+            write_csv(new_file, [",".join(filtered_data_frame.columns)], [filtered_data_frame[c].to_numpy() for c in filtered_data_frame.columns],
+                      ["%d"] + ["%s"] * (len(filtered_data_frame.columns) - 1), newline="\n")
             print(f"\rDone {new_file}")
 
 if __name__ == "__main__":
@@ -23,6 +23,8 @@ class TankProcessing:
         self.erosion_size = erosion_size
         self.dilation_size = dilation_size
         self.min_contour_area = min_contour_area
+        self._buffers = None
+        self._kernels = None
 
     # Gets the min & max bounds of this tank in pixel coords for a given resolution 
     def getMinMax(self, shape) -> Tuple[Tuple[int, int], Tuple[int, int]]:
@@ -39,53 +41,158 @@ class TankProcessing:
         slice_max_x = int(tank_min[0] + ((tank_max[0] - tank_min[0]) / slice_count) * (slice_i + 1))
         return (slice_min_x, tank_min[1]), (slice_max_x, tank_max[1])
 
-    def getMask(self, hsv_frame):
+    def getROI(self, shape) -> Tuple[Tuple[int, int], Tuple[int, int], Tuple[int, int], Tuple[int, int]]:
+        # Part of the frame getMask works on: the tank bounds (corners included, clipped to the frame)
+        # plus a margin wider than the blur and erode/dilate kernels reach, so cropping to it gives
+        # the same mask as processing the whole frame
+        tank_min, tank_max = self.getMinMax(shape)
+        rx0, rx1 = max(min(tank_min[0], tank_max[0]), 0), min(max(tank_min[0], tank_max[0]) + 1, shape[1])
+        ry0, ry1 = max(min(tank_min[1], tank_max[1]), 0), min(max(tank_min[1], tank_max[1]) + 1, shape[0])
+        margin = 3 + 2*max(self.erosion_size, self.dilation_size)
+        x0, x1 = max(rx0 - margin, 0), min(rx1 + margin, shape[1])
+        y0, y1 = max(ry0 - margin, 0), min(ry1 + margin, shape[0])
+        return (x0, y0), (x1, y1), (rx0 - x0, ry0 - y0), (rx1 - x0, ry1 - y0)
+
+    def getBuffers(self, shape):
+        # Work buffers of getMaskROI, reused between frames while the ROI keeps its size
+        if self._buffers is None or self._buffers[0].shape != shape:
+            self._buffers = [np.empty(shape, np.uint8) for _ in range(5)]
+        if self._kernels is None or self._kernels[0] != (self.erosion_size, self.dilation_size):
+            self._kernels = ((self.erosion_size, self.dilation_size),
+                             np.ones((2*self.erosion_size, 2*self.erosion_size), np.uint8),
+                             np.ones((2*self.dilation_size, 2*self.dilation_size), np.uint8))
+        return self._buffers, self._kernels[1], self._kernels[2]
+
+    def getMaskROI(self, hsv_frame):
+        # Same mask as getMask, but only for the ROI (see getROI). Returns the mask and the frame
+        # coords of its top left corner. The mask is a reused buffer, the next call overwrites it.
+        (x0, y0), (x1, y1), (rx0, ry0), (rx1, ry1) = self.getROI(hsv_frame.shape)
+        if x1 <= x0 or y1 <= y0 or rx1 <= rx0 or ry1 <= ry0:
+            return np.zeros((max(y1 - y0, 0), max(x1 - x0, 0)), np.uint8), (x0, y0)
+        hsv_roi = hsv_frame[y0:y1, x0:x1]
+        (hsv_mask, range_mask, mask_blurred, mask_eroded, result_mask), erosion_kernel, dilation_kernel = self.getBuffers(hsv_roi.shape[:2])
+
         # Mask based on hsv color ranges
-        hsv_mask = np.zeros((hsv_frame.shape[0], hsv_frame.shape[1]), np.uint8)
+        hsv_mask[:] = 0
         for hsvRange in self.hsvRanges:
-            hsv_mask |= cv2.inRange(hsv_frame, np.float32(hsvRange.minHSV), np.float32(hsvRange.maxHSV))
-        
-        # Create tank mask from tank bounds
-        tank_min, tank_max = self.getMinMax(hsv_frame.shape)
-        tank_mask = np.zeros((hsv_frame.shape[0], hsv_frame.shape[1]), np.uint8)
-        cv2.rectangle(tank_mask, tank_min, tank_max, (255), cv2.FILLED)
+            cv2.inRange(hsv_roi, np.float32(hsvRange.minHSV), np.float32(hsvRange.maxHSV), dst=range_mask)
+            hsv_mask |= range_mask
 
-        # bitwise and tank & hsv range masks together so we only get parts where both were true
-        anded_mask = hsv_mask & tank_mask
+        # Only keep the parts inside of the tank bounds
+        hsv_mask[:ry0] = 0
+        hsv_mask[ry1:] = 0
+        hsv_mask[:, :rx0] = 0
+        hsv_mask[:, rx1:] = 0
 
         # blur mask to smooth out noise
-        mask_blurred = cv2.GaussianBlur(anded_mask, (5, 5), 3)
-
-        # erode and dilate so smooth out even more
-        mask_eroded = cv2.erode(mask_blurred, np.ones((2*self.erosion_size, 2*self.erosion_size), np.uint8), iterations = 1)
-        mask_dilated = cv2.dilate(mask_eroded, np.ones((2*self.dilation_size, 2*self.dilation_size), np.uint8), iterations = 1)
-        
-        # find largest contour by area, this should be the fluid
-        contours, _ = cv2.findContours(mask_dilated, cv2.RETR_TREE, cv2.CHAIN_APPROX_SIMPLE)        
-        areas = [cv2.contourArea(c) for c in contours]
-        
-        result_mask = np.zeros((hsv_frame.shape[0], hsv_frame.shape[1]), np.uint8)
+        cv2.GaussianBlur(hsv_mask, (5, 5), 3, dst=mask_blurred)
+
+        # erode and dilate so smooth out even more, reusing the first buffer for the dilated mask
+        cv2.erode(mask_blurred, erosion_kernel, dst=mask_eroded, iterations = 1)
+        mask_dilated = cv2.dilate(mask_eroded, dilation_kernel, dst=hsv_mask, iterations = 1)
+
+        # find largest outer contour by area, this should be the fluid (holes are never larger than
+        # the contour around them)
+        contours, _ = cv2.findContours(mask_dilated, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
+
+        result_mask[:] = 0
         if len(contours) > 0:
-            largestContourI = np.argmax(areas)
+            areas = [cv2.contourArea(c) for c in contours]
+            largestContourI = int(np.argmax(areas))
             if areas[largestContourI] > self.min_contour_area:
                 cv2.drawContours(result_mask, contours, largestContourI, (255), cv2.FILLED)
 
+        return result_mask, (x0, y0)
+
+    def getMask(self, hsv_frame):
+        # Full frame mask of the fluid in this tank
+        roi_mask, (x0, y0) = self.getMaskROI(hsv_frame)
+        result_mask = np.zeros((hsv_frame.shape[0], hsv_frame.shape[1]), np.uint8)
+        result_mask[y0:y0 + roi_mask.shape[0], x0:x0 + roi_mask.shape[1]] = roi_mask
         return result_mask
 
+    def getProfile(self, mask, shape=None, origin: Tuple[int, int] = (0, 0)) -> 'FluidProfile':
+        # Fluid profile of every pixel column inside the tank bounds from a mask of this tank. Either a
+        # full frame mask (getMask) or a cropped one (getMaskROI) with the frame shape and its origin.
+        shape = mask.shape if shape is None else shape
+        tank_min, tank_max = self.getMinMax(shape)
+        x0, x1 = max(min(tank_min[0], tank_max[0]), 0), min(max(tank_min[0], tank_max[0]) + 1, shape[1])
+        y0, y1 = max(min(tank_min[1], tank_max[1]), 0), min(max(tank_min[1], tank_max[1]) + 1, shape[0])
+        fluid = mask[max(y0 - origin[1], 0):max(y1 - origin[1], 0), max(x0 - origin[0], 0):max(x1 - origin[0], 0)] != 0
+
+        # first/last fluid row of every column, from the first True going down and going up
+        has_fluid = fluid.any(axis=0)
+        top = np.where(has_fluid, y0 + np.argmax(fluid, axis=0), 0)
+        bottom = np.where(has_fluid, y0 + fluid.shape[0] - np.argmax(fluid[::-1], axis=0), 0)
+        return FluidProfile(np.arange(x0, x0 + fluid.shape[1]), top, bottom, np.count_nonzero(fluid, axis=0))
+
+    def getProfileBounds(self, profile: 'FluidProfile', slice_count: int, shape) -> List[Tuple[Tuple[int, int], Tuple[int, int]]]:
+        # Bounds of every slice, the highest top and lowest bottom of the profile columns in the slice
+        # (slice rectangles include both edge columns, so neighbouring slices share a column)
+        slices = [self.getSliceMinMax(shape, slice_i, slice_count) for slice_i in range(slice_count)]
+        x = profile.x
+        lo = np.searchsorted(x, [min(smin[0], smax[0]) for smin, smax in slices], side='left')
+        hi = np.searchsorted(x, [max(smin[0], smax[0]) for smin, smax in slices], side='right')
+
+        # reduceat over [lo0, hi0, lo1, hi1, ...], every other result is a slice. Padding keeps every
+        # index valid and makes empty slices come out as 'no fluid'.
+        has_fluid = profile.count > 0
+        top = np.r_[np.where(has_fluid, profile.top, np.iinfo(np.int64).max), np.iinfo(np.int64).max]
+        bottom = np.r_[np.where(has_fluid, profile.bottom, -1), -1]
+        edges = np.ravel(np.column_stack((lo, hi)))
+        slice_top = np.minimum.reduceat(top, edges)[::2]
+        slice_bottom = np.maximum.reduceat(bottom, edges)[::2]
+        slice_empty = (hi <= lo) | (slice_bottom < 0)
+
+        bounds = []
+        for (slice_min, slice_max), empty, t, b in zip(slices, slice_empty, slice_top, slice_bottom):
+            if empty:
+                bounds.append(((slice_min[0], 0), (slice_max[0], 0)))
+            else:
+                bounds.append(((slice_min[0], int(t)), (slice_max[0], int(b))))
+        return bounds
+
+    def getMaskBounds(self, mask, slice_count: int, shape=None, origin: Tuple[int, int] = (0, 0)) -> List[Tuple[Tuple[int, int], Tuple[int, int]]]:
+        # Bounds of every slice from a mask of this tank, so one mask serves all slices
+        shape = mask.shape if shape is None else shape
+        return self.getProfileBounds(self.getProfile(mask, shape, origin), slice_count, shape)
+
+    def getFill(self, profile: 'FluidProfile', shape, L: float) -> Tuple[float, float, float]:
+        # Fluid area (cm^2) seen in the frame, and an estimate of the fluid volume (cm^3) and fill
+        # fraction. The tank is taken as a vertical cylinder spanning the tank bounds (height L,
+        # diameter the bounds width) with the fluid reaching through its whole depth in every column.
+        tank_min, tank_max = self.getMinMax(shape)
+        height_px = abs(tank_max[1] - tank_min[1])
+        radius_px = abs(tank_max[0] - tank_min[0]) / 2
+        if height_px == 0 or radius_px == 0:
+            return 0.0, 0.0, 0.0
+        cm = L / height_px
+
+        u = profile.x + 0.5 - (tank_min[0] + tank_max[0] + 1) / 2
+        depth = 2*np.sqrt(np.maximum(radius_px**2 - u**2, 0))
+        area = float(profile.count.sum()) * cm**2
+        volume = float(np.dot(profile.count, depth)) * cm**3
+        return area, volume, volume / (np.pi * radius_px**2 * height_px * cm**3)
+
     def getBounds(self, hsv_frame, slice_i: int, slice_count: int) -> Tuple[Tuple[int, int], Tuple[int, int]]:
-        slice_min, slice_max = self.getSliceMinMax(hsv_frame.shape, slice_i, slice_count)
-        mask = self.getMask(hsv_frame)
-        
-        # Create slice mask from tank bounds, slice_i and slice_count
-        slice_mask = np.zeros((hsv_frame.shape[0], hsv_frame.shape[1]), np.uint8)
-        cv2.rectangle(slice_mask, slice_min, slice_max, (255), cv2.FILLED)
-
-        points = cv2.findNonZero(slice_mask & mask)
-        if (points is None) or (len(points) == 0):
-            return (slice_min[0], 0), (slice_max[0], 0)
-        
-        bounding_rect = cv2.boundingRect(points)
-        return (slice_min[0], bounding_rect[1]), (slice_max[0], bounding_rect[1] + bounding_rect[3])
+        return self.getMaskBounds(self.getMask(hsv_frame), slice_count)[slice_i]
+
+class FluidProfile:
+    # Fluid in every pixel column of a tank (see TankProcessing.getProfile): column x, top row and
+    # bottom row (last fluid row + 1) in frame pixel coords, and number of fluid pixels. Columns
+    # without fluid have count 0 and top = bottom = 0, which PxToHeight/getHeights read as no fluid.
+    def __init__(self, x, top, bottom, count):
+        self.x = x
+        self.top = top
+        self.bottom = bottom
+        self.count = count
+
+    def getHeights(self, miny: int, maxy: int, L: float) -> Tuple[np.ndarray, np.ndarray]:
+        # Top & bottom of every column as fluid heights (cm), like PxToHeight
+        with np.errstate(invalid='ignore', divide='ignore'):
+            top = np.where(self.top == 0, 0, L*(1 - (self.top - miny)/(maxy - miny)))
+            bottom = np.where(self.bottom == 0, 0, L*(1 - (self.bottom - miny)/(maxy - miny)))
+        return top, bottom
 
 def HSVRangeToJson(hsvRange: HSVRange) -> str:
     return json.dumps({
@@ -155,6 +262,19 @@ def PxToHeight(y: int, miny: int, maxy: int, L: float) -> float:
     
     return L*(1 - (y - miny)/(maxy - miny))            
 
+def CalculateProfiles(hsv_frame, tanks: List[TankProcessing]) -> List[FluidProfile]:
+    # Fluid profile of every tank. Each tank's mask is built once per frame.
+    profiles = []
+    for tank in tanks:
+        mask, origin = tank.getMaskROI(hsv_frame)
+        profiles.append(tank.getProfile(mask, hsv_frame.shape, origin))
+    return profiles
+
+def CalculateBounds(hsv_frame, tanks: List[TankProcessing], slice_count: int) -> List[List[Tuple[Tuple[int, int], Tuple[int, int]]]]:
+    # Bounds of every slice of every tank, bounds[tank][slice], all aggregated from the tank's profile
+    profiles = CalculateProfiles(hsv_frame, tanks)
+    return [tank.getProfileBounds(profile, slice_count, hsv_frame.shape) for tank, profile in zip(tanks, profiles)]
+
 def CalculateRow(raw_frame, frame_i: int, start_frame: int, fps: int, slice_count: int, L: float, scale_percent: float, tank1: TankProcessing, tank2: TankProcessing, tank3: TankProcessing):
     # resize frame
     width = int(raw_frame.shape[1] * scale_percent / 100)
@@ -163,30 +283,17 @@ def CalculateRow(raw_frame, frame_i: int, start_frame: int, fps: int, slice_coun
 
     # convert frame to HSV
     hsv_frame = cv2.cvtColor(resized_frame, cv2.COLOR_BGR2HSV)
-    
-    tank1_min, tank1_max = tank1.getMinMax(hsv_frame.shape)
-    tank2_min, tank2_max = tank2.getMinMax(hsv_frame.shape)
-    tank3_min, tank3_max = tank3.getMinMax(hsv_frame.shape)
+
+    tanks = [tank1, tank2, tank3]
+    tank_bounds = [tank.getMinMax(hsv_frame.shape) for tank in tanks]
+    slice_bounds = CalculateBounds(hsv_frame, tanks, slice_count)
 
     row = [frame_i, (frame_i-start_frame)/fps]
     for slice_i in range(slice_count):
-        tank1_slice_min, tank1_slice_max = tank1.getBounds(hsv_frame, slice_i, slice_count)
-        tank2_slice_min, tank2_slice_max = tank2.getBounds(hsv_frame, slice_i, slice_count)
-        tank3_slice_min, tank3_slice_max = tank3.getBounds(hsv_frame, slice_i, slice_count)
-
-        tank1_slice_top    = PxToHeight(tank1_slice_min[1], tank1_min[1], tank1_max[1], L)
-        tank1_slice_bottom = PxToHeight(tank1_slice_max[1], tank1_min[1], tank1_max[1], L)
-        
-        tank2_slice_top    = PxToHeight(tank2_slice_min[1], tank2_min[1], tank2_max[1], L)
-        tank2_slice_bottom = PxToHeight(tank2_slice_max[1], tank2_min[1], tank2_max[1], L)
-        
-        tank3_slice_top    = PxToHeight(tank3_slice_min[1], tank3_min[1], tank3_max[1], L)
-        tank3_slice_bottom = PxToHeight(tank3_slice_max[1], tank3_min[1], tank3_max[1], L)
-        
-        row += [
-            tank1_slice_bottom, tank1_slice_top,
-            tank2_slice_bottom, tank2_slice_top,
-            tank3_slice_bottom, tank3_slice_top,
-        ]
-    
+        for (tank_min, tank_max), bounds in zip(tank_bounds, slice_bounds):
+            slice_min, slice_max = bounds[slice_i]
+            slice_top    = PxToHeight(slice_min[1], tank_min[1], tank_max[1], L)
+            slice_bottom = PxToHeight(slice_max[1], tank_min[1], tank_max[1], L)
+            row += [slice_bottom, slice_top]
+
     return row
\ No newline at end of file